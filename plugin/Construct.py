@@ -3,7 +3,15 @@ sys.path.insert(0, str(pathlib.Path(__file__).parent.resolve() / 'lib'))
 
 import adsk.core, adsk.fusion, adsk.cam
 from . import fusion360utils as futil
+from . import config
 from . import kv
+from . import mainthread
+from . import util
+from . import autothumb
+from . import batchimport
+from . import scratchdoc
+from . import exportcache
+from . import repotree
 from .rpc import rpc
 from . import commands
 
@@ -13,8 +21,14 @@ futil.general_utils.DEBUG = True
 def run(context):
     app = adsk.core.Application.get()
     try:
+         mainthread.start(app)
          kv.start_background_thread(app)
+         exportcache.start(app)
          commands.start()
+         if config.RPC_STATS_DUMP_INTERVAL:
+             rpc.metrics.start_dumping(
+                 str(pathlib.Path(__file__).parent.resolve() / 'rpc_stats.json'),
+                 config.RPC_STATS_DUMP_INTERVAL)
     except:
         futil.handle_error('run')
 
@@ -25,5 +39,11 @@ def stop(context):
         futil.clear_handlers()
         commands.stop()
         kv.stop_background_thread()
+        autothumb.stop()
+        batchimport.stop()
+        scratchdoc.close()
+        util.shutdown_download_pool()
+        mainthread.stop()
+        rpc.metrics.stop_dumping()
     except:
         futil.handle_error('stop')
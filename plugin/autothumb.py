@@ -0,0 +1,157 @@
+import itertools
+import threading
+import functools
+import concurrent.futures
+
+from .rpc import rpc, notify, render_thumbnail, png_data_uri, download_deferred
+from .util import fetch_async, content_key
+from .blobcache import blob_cache
+from . import thumbcache
+from . import mainthread
+from . import fusion360utils as futil
+
+_batch_ids = itertools.count(1)
+_batches = dict()
+_lock = threading.Lock()
+
+
+class Batch(object):
+    def __init__(self, ident, items, options):
+        self.id = ident
+        self.items = items
+        self.options = options
+        self.futures = []
+        self.thumb_keys = []
+        self.remaining = len(items)
+        self.cancelled = False
+
+
+def stop():
+    with _lock:
+        batches = list(_batches.values())
+    for batch in batches:
+        _cancel(batch)
+
+
+def _thumb_key(url, sha, content_type, width=256, height=256, transparent=False, antialias=True):
+    # only content named by its blob sha can be matched to an earlier render.
+    key = content_key(url, sha)
+    if key.startswith('blob:'):
+        return thumbcache.thumbnail_key(key[5:], content_type, width, height, transparent, antialias)
+
+
+def _render(file_path, content_type, thumb_key, options):
+    png = render_thumbnail(file_path, content_type, **options)
+    if png and thumb_key:
+        thumbcache.put(thumb_key, png)
+    return png
+
+
+@rpc.method
+def autothumb(url, content_type, token, width=256, height=256, transparent=False, antialias=True, sha=None):
+    options = dict(width=width, height=height, transparent=transparent, antialias=antialias)
+    thumb_key = _thumb_key(url, sha, content_type, **options)
+    png = thumb_key and thumbcache.get(thumb_key)
+    if png:
+        return png_data_uri(png)
+
+    def finish(file_path):
+        png = _render(file_path, content_type, thumb_key, options)
+        return png and png_data_uri(png)
+
+    # the palette treats null as "no thumbnail" and moves on to the next one.
+    return download_deferred(url, token, finish, extension=content_type, sha=sha, reject=False)
+
+
+def _downloaded(batch, index, future):
+    # runs on a download thread: hand the item over to the main thread, which
+    # is the only place Fusion may import and render.
+    mainthread.call_soon(_item_ready, batch, index)
+
+
+def _item_ready(batch, index):
+    if batch.cancelled:
+        return
+
+    item = batch.items[index]
+    future = batch.futures[index]
+    result = dict(batch=batch.id, index=index, id=item.get('id'), url=item.get('url'))
+    try:
+        if future.cancelled():
+            result['error'] = 'cancelled'
+        elif future.exception() is not None:
+            result['error'] = str(future.exception())
+        else:
+            png = future.result()
+            if not isinstance(png, bytes):
+                content_type = item['content_type']
+                # KeyError if the download was evicted before its turn.
+                with blob_cache.checkout(png, 'model.{}'.format(content_type)) as file_path:
+                    png = _render(file_path, content_type, batch.thumb_keys[index], batch.options)
+            if png:
+                result['thumbnail'] = png_data_uri(png)
+            else:
+                result['error'] = 'rendering failed'
+    except Exception as ex:
+        futil.log('Thumbnail of {} failed: {!r}'.format(item.get('url'), ex))
+        result['error'] = str(ex) or type(ex).__name__
+    notify('autothumb_result', **result)
+
+    with _lock:
+        batch.remaining -= 1
+        finished = batch.remaining == 0
+        if finished:
+            _batches.pop(batch.id, None)
+    if finished:
+        notify('autothumb_done', batch=batch.id)
+
+
+def _cancel(batch):
+    batch.cancelled = True
+    for future in batch.futures:
+        future.cancel()
+    with _lock:
+        _batches.pop(batch.id, None)
+
+
+@rpc.method
+def autothumb_batch(items, token, width=256, height=256, transparent=False, antialias=True):
+    """
+    Render thumbnails for `items` ({url, content_type, sha?, id?} objects).
+
+    Downloads run ahead on the download pool while the previous item is being
+    rendered.  Returns a batch id immediately; each result is delivered as an
+    `autothumb_result` notification (with `thumbnail` or `error`), followed by
+    `autothumb_done` once every item has been handled.
+    """
+    options = dict(width=width, height=height, transparent=transparent, antialias=antialias)
+    batch = Batch(next(_batch_ids), list(items), options)
+    with _lock:
+        _batches[batch.id] = batch
+    for item in batch.items:
+        thumb_key = _thumb_key(item['url'], item.get('sha'), item.get('content_type'), **options)
+        batch.thumb_keys.append(thumb_key)
+        png = thumb_key and thumbcache.get(thumb_key)
+        if png:
+            # already rendered, nothing to download.
+            future = concurrent.futures.Future()
+            future.set_result(png)
+        else:
+            future = fetch_async(item['url'], token, item.get('sha'))
+        batch.futures.append(future)
+    # callbacks only once every future is in place, some may fire immediately.
+    for index, future in enumerate(batch.futures):
+        future.add_done_callback(functools.partial(_downloaded, batch, index))
+    if not batch.items:
+        with _lock:
+            del _batches[batch.id]
+        notify('autothumb_done', batch=batch.id)
+    return batch.id
+
+
+@rpc.method
+def autothumb_cancel(batch):
+    with _lock:
+        batch = _batches.get(batch)
+    if batch is not None:
+        _cancel(batch)
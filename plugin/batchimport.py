@@ -0,0 +1,123 @@
+import itertools
+import threading
+import functools
+
+from .rpc import rpc, notify, import_file
+from .util import fetch_async
+from .blobcache import blob_cache
+from . import mainthread
+from . import fusion360utils as futil
+
+# Batches of imports: every file downloads concurrently on the download
+# pool, and each is imported on the main thread as soon as it lands, one at
+# a time, so a batch takes about as long as its slowest download plus the
+# imports still left at that point.
+IMPORTABLE = ('step', 'f3d', 'svg')
+
+_batch_ids = itertools.count(1)
+_batches = dict()
+_lock = threading.Lock()
+
+
+class Batch(object):
+    def __init__(self, ident, items):
+        self.id = ident
+        self.items = items
+        self.remaining = len(items)
+        self.imported = 0
+        self.failed = 0
+        self.cancelled = False
+
+
+def stop():
+    with _lock:
+        batches = list(_batches.values())
+        _batches.clear()
+    for batch in batches:
+        batch.cancelled = True
+
+
+def _downloaded(batch, index, future):
+    # runs on a download thread; Fusion may only import on the main thread.
+    mainthread.call_soon(_import_item, batch, index, future)
+
+
+def _import_item(batch, index, future):
+    item = batch.items[index]
+    result = dict(batch=batch.id, index=index, id=item.get('id'), url=item['url'])
+    content_type = item.get('content_type')
+    if batch.cancelled or future.cancelled():
+        # downloads are shared with other callers, so cancelling a batch
+        # leaves them running; whatever finishes just stays in the cache.
+        result['error'] = 'cancelled'
+    elif future.exception() is not None:
+        result['error'] = str(future.exception())
+    else:
+        filename = '{}.{}'.format(item.get('filename') or 'model', content_type)
+        try:
+            with blob_cache.checkout(future.result(), filename) as file_path:
+                import_file(file_path, content_type)
+        except Exception as ex:
+            futil.log('Import of {} failed: {}'.format(item['url'], ex))
+            result['error'] = str(ex)
+    _finish_item(batch, result)
+
+
+def _finish_item(batch, result):
+    notify('import_result', **result)
+    with _lock:
+        if 'error' in result:
+            batch.failed += 1
+        else:
+            batch.imported += 1
+        batch.remaining -= 1
+        finished = batch.remaining == 0
+        if finished:
+            _batches.pop(batch.id, None)
+    if finished:
+        notify('import_done', batch=batch.id, imported=batch.imported,
+               failed=batch.failed, cancelled=batch.cancelled)
+
+
+@rpc.method
+def import_models(items, token):
+    """
+    Import `items` ({url, content_type, sha?, filename?, id?} objects, with
+    a content type of step, f3d or svg) into the active design.
+
+    Returns a batch id immediately.  Each item is reported by an
+    `import_result` notification (with `error` if it failed, which doesn't
+    affect the others), followed by `import_done` with the totals.
+    """
+    batch = Batch(next(_batch_ids), list(items))
+    with _lock:
+        _batches[batch.id] = batch
+    futures = []
+    for item in batch.items:
+        if item.get('content_type') in IMPORTABLE:
+            futures.append(fetch_async(item['url'], token, item.get('sha')))
+        else:
+            futures.append(None)
+    # callbacks only once every download has started, some may fire at once.
+    for index, future in enumerate(futures):
+        if future is None:
+            error = "can't batch import content type {}".format(batch.items[index].get('content_type'))
+            mainthread.call_soon(_finish_item, batch, dict(
+                batch=batch.id, index=index, id=batch.items[index].get('id'),
+                url=batch.items[index]['url'], error=error))
+        else:
+            future.add_done_callback(functools.partial(_downloaded, batch, index))
+    if not batch.items:
+        with _lock:
+            del _batches[batch.id]
+        notify('import_done', batch=batch.id, imported=0, failed=0, cancelled=False)
+    return batch.id
+
+
+@rpc.method
+def import_models_cancel(batch):
+    """Skip the items of `batch` that haven't been imported yet."""
+    with _lock:
+        batch = _batches.get(batch)
+    if batch is not None:
+        batch.cancelled = True
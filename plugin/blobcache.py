@@ -0,0 +1,142 @@
+import os
+import json
+import shutil
+import hashlib
+import pathlib
+import tempfile
+import threading
+import contextlib
+from collections import OrderedDict
+
+from . import config
+
+
+class BlobCache(object):
+    """
+    On-disk store of downloaded files, keyed by content identity.
+
+    Each entry is a single file named after the sha256 of its key.  Writes go
+    to a temporary file in the same directory and are renamed into place, so a
+    crash mid-download never leaves a truncated entry behind.  File mtimes are
+    used as the LRU clock, which keeps the index rebuildable from disk alone.
+    Entries may carry a small JSON sidecar (`<name>.meta`) holding validators
+    such as the ETag they were served with.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self._tmp_root = os.path.join(self.root, 'tmp')
+        self._lock = threading.RLock()
+        self._entries = None
+
+    def _path(self, key):
+        return os.path.join(self.root, hashlib.sha256(key.encode('utf8')).hexdigest())
+
+    def _index(self):
+        if self._entries is None:
+            os.makedirs(self._tmp_root, exist_ok=True)
+            found = []
+            for entry in os.scandir(self.root):
+                if entry.is_file() and '.' not in entry.name:
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+            self._entries = OrderedDict((name, size) for _, name, size in sorted(found))
+        return self._entries
+
+    def size(self):
+        with self._lock:
+            return sum(self._index().values())
+
+    def get(self, key):
+        """Return the path of the cached file for `key`, or None."""
+        path = self._path(key)
+        name = os.path.basename(path)
+        with self._lock:
+            entries = self._index()
+            if name not in entries:
+                return None
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                del entries[name]
+                return None
+            entries.move_to_end(name)
+            return path
+
+    def get_meta(self, key):
+        """Return the metadata stored alongside `key`, or an empty dict."""
+        try:
+            with open(self._path(key) + '.meta', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    @contextlib.contextmanager
+    def writer(self, key, meta=None):
+        """
+        Yield a writable binary file; its contents become the entry for `key`
+        only if the block exits without an exception.  `meta`, if given, is
+        stored as the entry's sidecar.
+        """
+        path = self._path(key)
+        with self._lock:
+            self._index()
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                os.replace(tmp_path, path)
+                if meta:
+                    with open(path + '.meta', 'w') as f:
+                        json.dump(meta, f)
+                else:
+                    with contextlib.suppress(OSError):
+                        os.unlink(path + '.meta')
+                entries = self._index()
+                entries[os.path.basename(path)] = size
+                entries.move_to_end(os.path.basename(path))
+                self.evict()
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        with self._lock:
+            entries = self._index()
+            total = sum(entries.values())
+            # never evict the most recently used entry, it's about to be read.
+            while total > self.max_bytes and len(entries) > 1:
+                name, size = entries.popitem(last=False)
+                for suffix in ('', '.meta'):
+                    with contextlib.suppress(OSError):
+                        os.unlink(os.path.join(self.root, name + suffix))
+                total -= size
+
+    @contextlib.contextmanager
+    def checkout(self, key, filename):
+        """
+        Expose the entry for `key` as `filename` in a scratch directory.
+
+        Importers derive component names from the file name, so callers get a
+        properly named hard link (or copy, where linking isn't possible) rather
+        than the hashed entry itself.
+        """
+        path = self.get(key)
+        if path is None:
+            raise KeyError(key)
+        with tempfile.TemporaryDirectory(dir=self._tmp_root) as temp_dir:
+            full_path = os.path.join(temp_dir, filename)
+            try:
+                os.link(path, full_path)
+            except OSError:
+                shutil.copyfile(path, full_path)
+            yield full_path
+
+
+blob_cache = BlobCache(
+    pathlib.Path(__file__).parent.resolve() / config.DOWNLOAD_CACHE_DIR,
+    config.DOWNLOAD_CACHE_MAX_BYTES)
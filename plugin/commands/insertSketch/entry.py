@@ -3,7 +3,6 @@ import os
 from ... import fusion360utils as futil
 from ... import config
 from ... import importing
-from ...util import download
 app = adsk.core.Application.get()
 ui = app.userInterface
 
@@ -28,6 +27,9 @@ ICON_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resource
 # they are not released and garbage collected.
 local_handlers = []
 
+# The queued import this command instance will insert; see importing.
+sketch_item = None
+
 
 # Executed when add-in is run.
 def start():
@@ -54,6 +56,11 @@ def command_created(args: adsk.core.CommandCreatedEventArgs):
     # General logging for debug.
     futil.log(f'{CMD_NAME} Command Created Event')
 
+    # claim the item now: a command cancelled by the next import's command
+    # must not leave its item at the head of the queue.
+    global sketch_item
+    sketch_item = importing.next_import()
+
     inputs = args.command.commandInputs
 
     # Create a simple text box input.
@@ -80,12 +87,15 @@ def command_execute(args: adsk.core.CommandEventArgs):
     inputs = args.command.commandInputs
     plane_input: adsk.core.SelectionCommandInput = inputs.itemById('plane')
     plane = plane_input.selection(0).entity
-    sketch_info = importing.get_importing()
-    importing.set_importing(None)
+    global sketch_item
+    item, sketch_item = sketch_item, None
+    if item is None:
+        futil.log(f'{CMD_NAME}: nothing queued to insert')
+        return
     product = app.activeProduct
     design = adsk.fusion.Design.cast(product)
     target = design.rootComponent
-    with download(**sketch_info) as filename:
+    with item.checkout() as filename:
         futil.log("type {}".format(plane.classType()))
         opts = app.importManager.createDXF2DImportOptions(filename, plane);
         app.importManager.importToTarget(opts, target)
@@ -133,5 +143,6 @@ def command_destroy(args: adsk.core.CommandEventArgs):
     # General logging for debug.
     futil.log(f'{CMD_NAME} Command Destroy Event')
 
-    global local_handlers
+    global local_handlers, sketch_item
     local_handlers = []
+    sketch_item = None
@@ -163,7 +163,8 @@ def palette_incoming(html_args: adsk.core.HTMLEventArgs):
     message_action = html_args.action
     if message_action == 'jsonrpc':
         response = rpc.handle_request_body(html_args.data);
-        if response is not None:
+        # deferred methods answer later, through rpc.responder.
+        if response:
             palette = app.userInterface.palettes.itemById(PALETTE_ID)
             palette.sendInfoToHTML('jsonrpc', response);
 
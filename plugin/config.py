@@ -11,4 +11,76 @@ DEBUG = True
 # part of the ID to better ensure the ID is unique.
 ADDIN_NAME = 'Voron_Construct'
 
-construct_palette_id = 'voronConstruct'
\ No newline at end of file
+construct_palette_id = 'voronConstruct'
+
+# Local cache of downloaded model files, so repeat imports don't hit GitHub.
+# The cache lives next to db.sqlite3 and is trimmed (least recently used
+# first) whenever it grows past DOWNLOAD_CACHE_MAX_BYTES.
+DOWNLOAD_CACHE_DIR = 'blobs'
+DOWNLOAD_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Connections kept open per host by the shared HTTP session.
+HTTP_POOL_MAXSIZE = 8
+
+# Downloads are streamed to disk in chunks and resumed with HTTP Range
+# requests if the connection drops; anything over the size limit is refused.
+HTTP_TIMEOUT = 30
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_MAX_BYTES = 1024 * 1024 * 1024
+DOWNLOAD_RETRIES = 3
+
+# Background downloads (prefetching, batch imports) share a pool this size.
+DOWNLOAD_WORKERS = 4
+
+# Rendered thumbnails are kept in db.sqlite3, up to this many bytes of PNG.
+THUMBNAIL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Render thumbnails in one reused scratch document rather than a new
+# document per model; it's closed after THUMBNAIL_SCRATCH_IDLE idle seconds.
+THUMBNAIL_SCRATCH_DOCUMENT = True
+THUMBNAIL_SCRATCH_IDLE = 30
+
+# Large results (exports, screenshots) can be handed to the palette as spool
+# handles and read back in chunks of at most SPOOL_MAX_CHUNK bytes.  Files
+# not read for SPOOL_TTL seconds are removed.
+SPOOL_DIR = 'spool'
+SPOOL_MAX_CHUNK = 1024 * 1024
+SPOOL_TTL = 60 * 60
+
+# How many recent STEP/F3D exports to keep for reuse by export_model.
+EXPORT_CACHE_DIR = 'exports'
+EXPORT_CACHE_ENTRIES = 4
+
+# Write rpc_stats() to rpc_stats.json next to db.sqlite3 every this many
+# seconds; 0 turns the periodic dump off.
+RPC_STATS_DUMP_INTERVAL = 0
+
+# kv store tuning.  With KV_WRITE_BEHIND, kv_set/kv_mset/kv_del/kv_mdel are
+# collected for KV_WRITE_BEHIND_DELAY seconds and committed together (and on
+# shutdown, or before a read of a key that's still pending).
+KV_CACHE_SIZE_KB = 8192
+KV_WRITE_BEHIND = False
+KV_WRITE_BEHIND_DELAY = 0.5
+
+# Decoded kv values kept in memory for repeat reads.
+KV_MEMORY_CACHE_ENTRIES = 512
+KV_MEMORY_CACHE_BYTES = 16 * 1024 * 1024
+
+# kv values at least this large (in bytes of JSON) are stored compressed.
+KV_COMPRESS_MIN_BYTES = 4096
+KV_COMPRESS_LEVEL = 3
+
+# cache: kv entries not read for this long are dropped, at most
+# KV_EXPIRE_BATCH rows per cache timer tick.  The timer runs
+# KV_FLUSH_LATENCY seconds after a read (to write access times) and at
+# least every KV_MAX_IDLE seconds.
+KV_CACHE_IDLE_TTL = 30 * 86400
+KV_EXPIRE_BATCH = 100
+KV_FLUSH_LATENCY = 2.0
+KV_MAX_IDLE = 60
+
+# Byte budgets for kv namespaces (the part of the key before the first ':').
+# Over budget, least recently read rows are evicted a batch at a time.
+KV_NAMESPACE_BUDGETS = {
+    'cache': 256 * 1024 * 1024,
+}
@@ -0,0 +1,75 @@
+import os
+import shutil
+import pathlib
+import itertools
+import contextlib
+from collections import OrderedDict
+
+import adsk.core
+from . import config
+from . import fusion360utils as futil
+
+# Recent exports, reused while the design they came from is unchanged.  Every
+# command the user completes bumps the generation, so an edit of any kind
+# (even one that doesn't add a timeline feature) invalidates the cache.  API
+# edits made by the add-in itself aren't commands and call invalidate().
+_export_dir = str(pathlib.Path(__file__).parent.resolve() / config.EXPORT_CACHE_DIR)
+_generation = 0
+_entries = OrderedDict()
+_names = itertools.count()
+
+shutil.rmtree(_export_dir, ignore_errors=True)
+os.makedirs(_export_dir, exist_ok=True)
+
+
+def start(app):
+    futil.add_handler(app.userInterface.commandTerminated, _on_command_terminated)
+
+
+def _on_command_terminated(args):
+    invalidate()
+
+
+def invalidate():
+    global _generation
+    _generation += 1
+
+
+def signature(design, comp):
+    """Identifies `comp` in its current state."""
+    try:
+        timeline = design.timeline
+        position = (timeline.markerPosition, timeline.count)
+    except:
+        # direct modelling designs have no timeline.
+        position = None
+    # a cheap content signal too, for edits made outside any command.
+    contents = (comp.allOccurrences.count, comp.bRepBodies.count)
+    return (design.parentDocument.creationId, comp.entityToken, position, contents, _generation)
+
+
+def export(design, comp, fmt):
+    """
+    Return the path of a `fmt` ('step' or 'f3d') export of `comp`, running the
+    exporter only if the design changed since the last export.
+    """
+    key = (signature(design, comp), fmt)
+    path = _entries.get(key)
+    if path and os.path.exists(path):
+        _entries.move_to_end(key)
+        return path
+
+    exportManager = design.exportManager
+    path = os.path.join(_export_dir, '{}.{}'.format(next(_names), fmt))
+    if fmt == 'step':
+        options = exportManager.createSTEPExportOptions(path, comp)
+    else:
+        options = exportManager.createFusionArchiveExportOptions(path, comp)
+    exportManager.execute(options)
+
+    _entries[key] = path
+    while len(_entries) > config.EXPORT_CACHE_ENTRIES:
+        _, stale = _entries.popitem(last=False)
+        with contextlib.suppress(OSError):
+            os.unlink(stale)
+    return path
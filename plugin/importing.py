@@ -1,8 +1,55 @@
-_importing = None
+import contextlib
+import collections
+from .util import fetch_async, download
+from .blobcache import blob_cache
 
-def set_importing(item):
-    global _importing
-    _importing = item
+# Sketches waiting for the Insert Sketch command, oldest first.  Each one
+# starts downloading when it's queued, so the file is normally on disk by
+# the time the user has picked a plane.
+_pending = collections.deque()
 
-def get_importing():
-    return _importing
+
+class PendingImport(object):
+    def __init__(self, url, token, extension, filename=None, sha=None):
+        self.url = url
+        self.token = token
+        self.extension = extension
+        self.filename = filename
+        self.sha = sha
+        self.future = fetch_async(url, token, sha)
+
+    @contextlib.contextmanager
+    def checkout(self):
+        """Wait for the download if it's still running, and yield the local file."""
+        try:
+            key = self.future.result()
+        except Exception:
+            key = None
+        with contextlib.ExitStack() as stack:
+            path = None
+            if key is not None:
+                try:
+                    path = stack.enter_context(
+                        blob_cache.checkout(key, '{}.{}'.format(self.filename or 'model', self.extension)))
+                except KeyError:
+                    # evicted from the cache since it was downloaded.
+                    pass
+            if path is None:
+                # the background download failed or is gone; fetch it again, now.
+                path = stack.enter_context(
+                    download(self.url, self.token, self.filename, self.extension, self.sha))
+            yield path
+
+
+def enqueue(url, token, extension, filename=None, sha=None):
+    item = PendingImport(url, token, extension, filename, sha)
+    _pending.append(item)
+    return item
+
+
+def next_import():
+    """Take the oldest queued import, or None."""
+    try:
+        return _pending.popleft()
+    except IndexError:
+        return None
@@ -4,12 +4,18 @@ try:
 except ImportError:
     from collections import Mapping
     
+import re
 import json
+import uuid
 import six
 
 import logging
+import threading
+import time
 
 from . import introspection
+from .metrics import Metrics
+from .profiling import Profiler
 
 log = logging.getLogger(__name__)
 
@@ -45,6 +51,47 @@ class RpcException(BaseJsonRpcException):
         super(RpcException, self).__init__(message, data=data)
 
 
+class Deferred(object):
+    """
+    Returned by a method whose result isn't ready yet.  The service sends the
+    response through its `responder` once `resolve` or `reject` is called,
+    which may happen on any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._outcome = None
+
+    def resolve(self, result):
+        self._finish((result, None))
+
+    def reject(self, exception):
+        self._finish((None, exception))
+
+    def _finish(self, outcome):
+        with self._lock:
+            if self._outcome is not None:
+                return
+            self._outcome = outcome
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if self._outcome is None:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self._outcome is not None
+
+    def outcome(self):
+        return self._outcome
+
+
 class Result(object):
     def __init__(self, id, result):
         self.version = '2.0'
@@ -59,6 +106,58 @@ class Result(object):
                 }
 
 
+class RawJSON(object):
+    """
+    Already serialized JSON text, spliced into a response verbatim instead of
+    being decoded and re-encoded.  The text must be valid JSON.
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def dumps(obj):
+    """`json.dumps` that also understands RawJSON values anywhere in `obj`."""
+    raw = []
+    # a NUL can't appear unescaped in encoded JSON and the nonce can't be
+    # guessed, so the quoted marker can't be confused with a real string.
+    nonce = []
+
+    def default(value):
+        if isinstance(value, RawJSON):
+            if not nonce:
+                nonce.append(uuid.uuid4().hex)
+            raw.append(value.text)
+            return '\x00%s:%d\x00' % (nonce[0], len(raw) - 1)
+        raise TypeError('Object of type %s is not JSON serializable'
+                        % value.__class__.__name__)
+
+    text = json.dumps(obj, default=default)
+    if not raw:
+        return text
+    marker = re.compile(r'"\\u0000%s:(\d+)\\u0000"' % nonce[0])
+    return marker.sub(lambda m: raw[int(m.group(1))], text)
+
+
+class Notification(object):
+    def __init__(self, method, params=None):
+        self.version = '2.0'
+        self.method = method
+        self.params = params
+
+    def as_dict(self):
+        notification = {
+            'jsonrpc': self.version,
+            'method': self.method,
+            }
+
+        if self.params is not None:
+            notification['params'] = self.params
+
+        return notification
+
+
 class Error(object):
     def __init__(self, id, message, code, data=None):
         self.version = '2.0'
@@ -116,10 +215,19 @@ class InternalError(Error):
 
 
 class Service(object):
-    def __init__(self):
+    def __init__(self, responder=None, profile_dir=None):
         self._methods = {}
+        # called with the serialized response of each resolved Deferred.
+        self.responder = responder
+        self.metrics = Metrics()
+        self.profile_dir = profile_dir
+        self._profiler = None
+        self._profile_files = []
         self.register('trait_names', self.trait_names)
         self.register('_getAttributeNames', self.get_attribute_names)
+        self.register('rpc_stats', self.rpc_stats)
+        self.register('profile_start', self.profile_start)
+        self.register('profile_stop', self.profile_stop)
 
     def handle_http_request(self, request):
         """
@@ -137,17 +245,99 @@ class Service(object):
     def handle_request_body(self, body, http_request=None):
         log.debug('Got request raw body: %s', body)
 
+        started = time.perf_counter()
         request_dict = self.parse_request_body(body)
-        response = self.dispatch(request_dict, http_request)
+        parse_time = time.perf_counter() - started
+        if isinstance(request_dict, list):
+            return self.handle_batch(
+                request_dict, http_request, parse_time, len(body))
 
         try:
-            response = json.dumps(response.as_dict()) if response else ''
+            response = self.dispatch(request_dict, http_request)
+        except Exception as ex:
+            # reply anyway, or the caller waits for a response forever.
+            log.debug('Internal error: %s', ex)
+            ident = request_dict.get('id') if isinstance(request_dict, Mapping) else None
+            response = InternalError(ident, six.text_type(ex)) if ident else None
+
+        started = time.perf_counter()
+        try:
+            response = dumps(response.as_dict()) if response else ''
             log.debug('Sending raw response: %s', response)
-            return response
         except (TypeError, ValueError) as ex:
             log.debug('Internal error: %s', ex)
-            return json.dumps(InternalError(
+            response = json.dumps(InternalError(
                 request_dict.get('id'), six.text_type(ex)).as_dict())
+        self._record_io(request_dict, parse_time,
+                        time.perf_counter() - started, len(body), len(response))
+        return response
+
+    def _record_io(self, request, parse, serialize, request_bytes,
+                   response_bytes):
+        method = request.get('method') if isinstance(request, Mapping) else None
+        if method in self._methods:
+            self.metrics.record_io(method, parse, serialize, request_bytes,
+                                   response_bytes)
+
+    def handle_batch(self, requests, http_request=None, parse_time=0.0,
+                     request_bytes=0):
+        """
+        Dispatch a JSON-RPC batch and return the serialized array of
+        responses, or '' if every request was a notification.
+
+        Parse and serialization time, and payload sizes, are shared evenly
+        between the batch entries in the metrics.
+        """
+        if not requests:
+            return json.dumps(InvalidRequestError(
+                None, 'Empty batch request').as_dict())
+
+        responses = []
+        for request in requests:
+            if not isinstance(request, Mapping):
+                responses.append(InvalidRequestError(
+                    None, 'Batch entry must be a request object').as_dict())
+                continue
+
+            ident = request.get('id')
+            try:
+                response = self.dispatch(request, http_request)
+            except Exception as ex:
+                # one failing call must not take the rest of the batch down.
+                log.debug('Internal error in batch entry: %s', ex)
+                response = InternalError(ident, six.text_type(ex)) \
+                    if ident else None
+            if response:
+                responses.append(response.as_dict())
+
+        started = time.perf_counter()
+        response = ''
+        if responses:
+            try:
+                response = dumps(responses)
+            except (TypeError, ValueError):
+                # find the entries that can't be serialized and replace them.
+                response = dumps(
+                    [self._serializable(r) for r in responses])
+            log.debug('Sending raw response: %s', response)
+
+        share = 1.0 / len(requests)
+        serialize_time = time.perf_counter() - started
+        for request in requests:
+            self._record_io(request, parse_time * share,
+                            serialize_time * share,
+                            int(request_bytes * share),
+                            int(len(response) * share))
+        return response
+
+    def _serializable(self, response):
+        try:
+            dumps(response)
+            return response
+        except (TypeError, ValueError) as ex:
+            log.debug('Internal error: %s', ex)
+            return InternalError(
+                response.get('id'), six.text_type(ex)).as_dict()
 
     def parse_request_body(self, body):
         try:
@@ -189,6 +379,7 @@ class Service(object):
             else:
                 return
 
+        name = method
         try:
             log.debug('Calling method `%s`', method)
             method = self._methods[method]
@@ -220,21 +411,76 @@ class Service(object):
 
         
         try:
-            introspection.validate_signature(method['callback'], *args, **kwargs)
+            method['validate'](args, kwargs)
         except TypeError as ex:
             log.debug('Invalid method parameters: %s', ex)
+            self.metrics.record_call(name, 0.0, error=True)
             if ident:
                 return InvalidParametersError(
                     ident, data=six.text_type(ex))
             else:
                 return
 
+        started = time.perf_counter()
+        profiler = self._profiler
         try:
-            result = method['callback'](*args, **kwargs)
+            if profiler is not None and profiler.wants(name):
+                try:
+                    result = profiler.run(
+                        name, method['callback'], args, kwargs)
+                finally:
+                    if profiler.done():
+                        self.profile_stop()
+            else:
+                result = method['callback'](*args, **kwargs)
         except BaseJsonRpcException as ex:
+            self.metrics.record_call(
+                name, time.perf_counter() - started, error=True)
             return Error(ident, ex.message, ex.code, data=ex.data)
+        except Exception:
+            self.metrics.record_call(
+                name, time.perf_counter() - started, error=True)
+            raise
+
+        if isinstance(result, Deferred):
+            log.debug('Deferring response to request ID: %s', ident)
+            # latency of a deferred call runs until it resolves.
+            result.add_done_callback(
+                lambda deferred: self._respond_deferred(
+                    ident, name, started, deferred))
+            return None
+
+        self.metrics.record_call(name, time.perf_counter() - started)
+        return Result(ident, result) if ident else None
+
+    def _respond_deferred(self, ident, name, started, deferred):
+        result, exception = deferred.outcome()
+        self.metrics.record_call(name, time.perf_counter() - started,
+                                 error=exception is not None)
+        if not ident:
+            return
+
+        if exception is None:
+            response = Result(ident, result)
+        elif isinstance(exception, BaseJsonRpcException):
+            response = Error(ident, exception.message, exception.code,
+                             data=exception.data)
+        else:
+            response = InternalError(ident, six.text_type(exception))
+
+        try:
+            response = dumps(response.as_dict())
+        except (TypeError, ValueError) as ex:
+            log.debug('Internal error: %s', ex)
+            response = json.dumps(InternalError(
+                ident, six.text_type(ex)).as_dict())
+
+        self.metrics.record_io(name, response_bytes=len(response))
+        log.debug('Sending deferred raw response: %s', response)
+        if self.responder is None:
+            log.warning('No responder for deferred response to %s', ident)
         else:
-            return Result(ident, result) if ident else None
+            self.responder(response)
 
     def method(self, method=None, takes_http_request=False):
 
@@ -258,6 +504,7 @@ class Service(object):
                 'callback': func,
                 'takes_http_request': takes_http_request,
                 'signature': introspection.get_signature(func),
+                'validate': introspection.compile_validator(func),
                 }
 
     def trait_names(self):
@@ -266,6 +513,39 @@ class Service(object):
     def get_attribute_names(self):
         return []
 
+    def profile_start(self, methods=None, max_calls=1):
+        """
+        Profile the next `max_calls` calls of each of `methods` (or of every
+        method, if none are given) with cProfile and tracemalloc.  Output
+        goes to `profile_dir`; profiling stops by itself once all the
+        requested calls were captured, or on `profile_stop`.
+        """
+        if self.profile_dir is None:
+            raise RpcException(1, 'Profiling is not configured')
+        self.profile_stop()
+        self._profile_files = []
+        profiler = Profiler(self.profile_dir, methods, max_calls,
+                            exclude=('profile_start', 'profile_stop'))
+        profiler.start()
+        self._profiler = profiler
+
+    def profile_stop(self):
+        """Stop profiling; returns the files written since `profile_start`."""
+        profiler, self._profiler = self._profiler, None
+        if profiler is not None:
+            self._profile_files = profiler.stop()
+        return self._profile_files
+
+    def rpc_stats(self, reset=False):
+        """
+        Per-method call/error counts, latency percentiles, payload sizes and
+        parse/call/serialize time since start (or the last reset).
+        """
+        stats = self.metrics.snapshot()
+        if reset:
+            self.metrics.reset()
+        return stats
+
     def public_methods(self):
         return dict(filter(
             lambda x: (not x[0].startswith('_')
@@ -0,0 +1,58 @@
+"""
+Micro-benchmark of per-call dispatch overhead for cheap methods.
+
+Compares the precompiled validators built at registration time against
+re-introspecting the callback on every call (`validate_signature`).  Run from
+the plugin directory with::
+
+    python -m jsonrpcserver.benchmark
+"""
+import json
+import timeit
+
+from . import Service, introspection
+
+
+def get_version():
+    return 4
+
+
+def kv_get(key):
+    return None
+
+
+REQUESTS = {
+    'get_version': json.dumps(
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'get_version', 'params': {}}),
+    'kv_get': json.dumps(
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'kv_get',
+         'params': {'key': 'preferences'}}),
+}
+
+
+def make_service(precompiled):
+    service = Service()
+    service.register('get_version', get_version)
+    service.register('kv_get', kv_get)
+    if not precompiled:
+        for meta in service._methods.values():
+            meta['validate'] = (
+                lambda args, kwargs, func=meta['callback']:
+                introspection.validate_signature(func, *args, **kwargs))
+    return service
+
+
+def main(number=20000):
+    for method, body in REQUESTS.items():
+        timings = {}
+        for precompiled in (False, True):
+            service = make_service(precompiled)
+            timings[precompiled] = min(timeit.repeat(
+                lambda: service.handle_request_body(body),
+                number=number, repeat=5)) / number * 1e6
+        print('%-12s getcallargs: %6.2f us/call   precompiled: %6.2f us/call'
+              % (method, timings[False], timings[True]))
+
+
+if __name__ == '__main__':
+    main()
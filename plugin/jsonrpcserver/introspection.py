@@ -23,6 +23,58 @@ def validate_signature(func, *args, **kwargs):
     return inspect.signature(func).bind(*args, **kwargs)
 
 
+def compile_validator(func):
+    """
+    Build a checker for calls to `func` from its signature, once.
+
+    The returned `validate(args, kwargs)` raises TypeError for the same
+    mistakes `validate_signature` catches (too many positionals, unknown or
+    duplicate keywords, missing required arguments) without re-inspecting
+    `func` on every call.
+    """
+    spec = get_signature(func)
+    params = list(spec.args)
+    if inspect.ismethod(func):
+        params = params[1:]
+    name = getattr(func, '__name__', repr(func))
+    varargs = spec.varargs is not None
+    varkw = spec.varkw is not None
+    defaults = spec.defaults or ()
+    kwonly = frozenset(getattr(spec, 'kwonlyargs', None) or ())
+    kwonly_required = tuple(
+        k for k in getattr(spec, 'kwonlyargs', None) or ()
+        if k not in (getattr(spec, 'kwonlydefaults', None) or {}))
+    positions = dict((p, i) for i, p in enumerate(params))
+    nparams = len(params)
+    required = nparams - len(defaults)
+
+    def validate(args, kwargs):
+        nargs = len(args)
+        if nargs > nparams and not varargs:
+            raise TypeError('%s() takes %d positional arguments but %d were '
+                            'given' % (name, nparams, nargs))
+        for key in kwargs:
+            index = positions.get(key)
+            if index is None:
+                if key not in kwonly and not varkw:
+                    raise TypeError('%s() got an unexpected keyword argument '
+                                    '%r' % (name, key))
+            elif index < nargs:
+                raise TypeError('%s() got multiple values for argument '
+                                '%r' % (name, key))
+        if nargs < required:
+            missing = [p for p in params[nargs:required] if p not in kwargs]
+            if missing:
+                raise TypeError('%s() missing required arguments: %s'
+                                % (name, ', '.join(missing)))
+        for key in kwonly_required:
+            if key not in kwargs:
+                raise TypeError('%s() missing required keyword-only argument: '
+                                '%r' % (name, key))
+
+    return validate
+
+
 def trim_docstring(docstring):
     if not docstring:
         return ''
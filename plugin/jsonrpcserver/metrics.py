@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+from collections import deque
+
+
+class MethodStats(object):
+    def __init__(self, samples):
+        self.calls = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=samples)
+        self.parse_time = 0.0
+        self.call_time = 0.0
+        self.serialize_time = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'max': (latencies[-1] if latencies else 0) * 1000,
+                },
+            'time_ms': {
+                'parse': self.parse_time * 1000,
+                'call': self.call_time * 1000,
+                'serialize': self.serialize_time * 1000,
+                },
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            }
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not ordered:
+        return 0
+    rank = max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Metrics(object):
+    """
+    Per-method call counts, error counts, latency percentiles (over the last
+    `samples` calls), payload sizes and where the time went: JSON parsing,
+    the callback itself and serialization.
+    """
+
+    def __init__(self, samples=1024):
+        self.samples = samples
+        self.started = time.time()
+        self._methods = {}
+        self._lock = threading.Lock()
+        self._dump_timer = None
+
+    def _stats(self, method):
+        stats = self._methods.get(method)
+        if stats is None:
+            stats = self._methods[method] = MethodStats(self.samples)
+        return stats
+
+    def record_call(self, method, elapsed, error=False):
+        with self._lock:
+            stats = self._stats(method)
+            stats.calls += 1
+            stats.errors += int(bool(error))
+            stats.call_time += elapsed
+            stats.latencies.append(elapsed)
+
+    def record_io(self, method, parse=0.0, serialize=0.0,
+                  request_bytes=0, response_bytes=0):
+        with self._lock:
+            stats = self._stats(method)
+            stats.parse_time += parse
+            stats.serialize_time += serialize
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self.started,
+                'methods': dict(
+                    (name, stats.as_dict())
+                    for name, stats in self._methods.items()),
+                }
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self.started = time.time()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+    def start_dumping(self, path, interval):
+        """Write a snapshot to `path` every `interval` seconds."""
+        def tick():
+            self.dump(path)
+            if self._dump_timer is not None:
+                self.start_dumping(path, interval)
+
+        self._dump_timer = threading.Timer(interval, tick)
+        self._dump_timer.daemon = True
+        self._dump_timer.start()
+
+    def stop_dumping(self):
+        if self._dump_timer is not None:
+            self._dump_timer.cancel()
+            self._dump_timer = None
@@ -0,0 +1,75 @@
+import os
+import time
+import cProfile
+import tracemalloc
+import threading
+
+
+class Profiler(object):
+    """
+    Runs selected RPC callbacks under cProfile and tracemalloc, writing a
+    `.pstats` file and an allocation snapshot (plus a short text summary of
+    what the call allocated) for each profiled call into `output_dir`.
+
+    Only the synchronous part of a call is captured; work a Deferred method
+    hands off to other threads is not.
+    """
+
+    def __init__(self, output_dir, methods=None, max_calls=1, exclude=()):
+        self.output_dir = output_dir
+        self.methods = frozenset(methods) if methods else None
+        self.exclude = frozenset(exclude)
+        self.max_calls = max_calls
+        self.calls = {}
+        self.files = []
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._started_tracemalloc = True
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return list(self.files)
+
+    def wants(self, method):
+        if method in self.exclude:
+            return False
+        if self.methods is not None and method not in self.methods:
+            return False
+        return self.calls.get(method, 0) < self.max_calls
+
+    def done(self):
+        """True once every requested method has used up its calls."""
+        return self.methods is not None and all(
+            self.calls.get(m, 0) >= self.max_calls for m in self.methods)
+
+    def run(self, method, func, args, kwargs):
+        with self._lock:
+            count = self.calls.get(method, 0) + 1
+            self.calls[method] = count
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            after = tracemalloc.take_snapshot()
+            self._write(method, count, profile, before, after)
+
+    def _write(self, method, count, profile, before, after):
+        base = os.path.join(self.output_dir, '{}-{}-{}'.format(
+            method, time.strftime('%Y%m%d-%H%M%S'), count))
+        profile.dump_stats(base + '.pstats')
+        after.dump(base + '.tracemalloc')
+        with open(base + '.alloc.txt', 'w') as f:
+            for stat in after.compare_to(before, 'lineno')[:50]:
+                f.write('{}\n'.format(stat))
+        self.files.extend(
+            base + suffix for suffix in ('.pstats', '.tracemalloc', '.alloc.txt'))
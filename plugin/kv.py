@@ -1,73 +1,212 @@
-import queue
 import os
+import re
 import sqlite3
 import pathlib
+import struct
+import zlib
 from .rpc import rpc
+from .jsonrpcserver import RawJSON, InvalidParametersException
 import time
 import json
 from contextlib import closing
 from . import fusion360utils as futil
 import threading
+from collections import OrderedDict
+from . import config
 
-stopFlag = None
+scheduler = None
 timerEvent = None
-timerQueue = queue.Queue()
 EVENT_ID = 'ConstructTimerEvent'
 
 
 
-class TimerThread(threading.Thread):
-    def __init__(self, event, q, app):
-        threading.Thread.__init__(self)
-        self.stopped = event
-        self.q = q
+class FlushScheduler(threading.Thread):
+    """
+    Fires EVENT_ID once scheduled work falls due, and otherwise every
+    `max_idle` seconds so expiry and budgets keep up.  Sleeps in between
+    instead of polling.
+    """
+
+    def __init__(self, app, max_idle):
+        threading.Thread.__init__(self, daemon=True)
         self.app = app
+        self.max_idle = max_idle
+        self.stopped = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._due = None
 
-    def run(self):
-        while not self.stopped.wait(0.5):
-            if self.q.qsize():
-                while self.q.qsize():
-                    self.q.get()
+    def schedule(self, delay):
+        """Make sure the timer event fires within `delay` seconds."""
+        due = time.time() + delay
+        with self._lock:
+            if self._due is not None and self._due <= due:
+                return
+            self._due = due
+        self._wake.set()
 
-            else:
-                self.app.fireCustomEvent(EVENT_ID, 'ok')
+    def stop(self):
+        self.stopped.set()
+        self._wake.set()
 
+    def run(self):
+        while not self.stopped.is_set():
+            with self._lock:
+                due = self._due
+            timeout = self.max_idle if due is None else max(0, due - time.time())
+            if self._wake.wait(timeout):
+                # an earlier deadline, or stop(); look again.
+                self._wake.clear()
+                continue
+            with self._lock:
+                self._due = None
+            self.app.fireCustomEvent(EVENT_ID, 'ok')
 
-def start_background_thread(app):
-    global stopFlag
-    global timerQueue
 
-    global timerEvent;
+def start_background_thread(app):
+    global scheduler
+    global timerEvent
     timerEvent = app.registerCustomEvent(EVENT_ID)
     futil.add_handler(timerEvent, on_cache_timer)
-    # Create a new thread for the other processing.
-    stopFlag = threading.Event()
-    myThread = TimerThread(stopFlag, timerQueue, futil.app)
-    myThread.start()
+    scheduler = FlushScheduler(futil.app, config.KV_MAX_IDLE)
+    scheduler.start()
+    if access_times or _pending:
+        _schedule(config.KV_FLUSH_LATENCY)
 
 
 def stop_background_thread():
-    stopFlag.set()
+    global scheduler
+    global timerEvent
+    if scheduler:
+        scheduler.stop()
+        scheduler.join()
+        scheduler = None
+    if timerEvent:
+        futil.app.unregisterCustomEvent(EVENT_ID)
+        timerEvent = None
+    flush_writes()
+    flush_access_times()
 
 
-def on_cache_timer(event):
-    global access_times
+def _schedule(delay):
+    if scheduler:
+        scheduler.schedule(delay)
+
+
+def _touch(key):
+    """Note a read of `key`; access times are written in batches."""
     if not access_times:
-        return
-    # global access_times
-    items = list(access_times.items())
-    with closing(conn.executemany('INSERT OR REPLACE INTO kvaccess (key, accesstime) VALUES (?, ?)', items)) as cursor:
-        conn.commit()
-        access_times = dict()
+        _schedule(config.KV_FLUSH_LATENCY)
+    access_times[key] = int(time.time())
 
-    one_month_ago = time.time() - (86400 * 30)
-    with closing(conn.execute("DELETE FROM kv WHERE key LIKE 'cache:%' AND key NOT IN (SELECT key FROM kvaccess where accesstime > ?)", (one_month_ago,))) as cursor:
-        conn.commit()
 
-    with closing(conn.execute('DELETE FROM kvaccess WHERE accesstime <= ? OR key NOT IN (SELECT key FROM kv)', (one_month_ago,))) as cursor:
+def flush_access_times():
+    global access_times
+    if access_times:
+        items = [(t, k) for k, t in access_times.items()]
+        access_times = dict()
+        conn.executemany('UPDATE kv SET accesstime = ? WHERE key = ?', items)
         conn.commit()
 
 
+def on_cache_timer(event):
+    if _pending:
+        wait = _pending_since + config.KV_WRITE_BEHIND_DELAY - time.time()
+        if wait > 0:
+            _schedule(wait)
+        else:
+            flush_writes()
+    flush_access_times()
+    # a full batch means there is probably more to do; come back soon.
+    if expire_batch() + enforce_budgets() >= config.KV_EXPIRE_BATCH:
+        _schedule(config.KV_FLUSH_LATENCY)
+
+
+def expire_batch(limit=None):
+    """
+    Delete up to `limit` expired rows: cache: entries idle for longer than
+    KV_CACHE_IDLE_TTL, and rows past their `expires` time.  Both lookups are
+    index range scans, so a tick costs the same however big the store is.
+    """
+    limit = limit or config.KV_EXPIRE_BATCH
+    now = int(time.time())
+    with closing(conn.execute('SELECT key FROM kv WHERE namespace = ? AND accesstime < ? LIMIT ?',
+                              ('cache', now - config.KV_CACHE_IDLE_TTL, limit))) as cursor:
+        idle = [r[0] for r in cursor]
+    expired = []
+    if len(idle) < limit:
+        with closing(conn.execute('SELECT key FROM kv WHERE expires <= ? LIMIT ?',
+                                  (now, limit - len(idle)))) as cursor:
+            expired = [r[0] for r in cursor]
+    _evict(idle, 'idle')
+    _evict(expired, 'expired')
+    return len(idle) + len(expired)
+
+
+def enforce_budgets(limit=None):
+    """
+    Evict least recently used rows from namespaces over their budget in
+    KV_NAMESPACE_BUDGETS, at most `limit` rows per call.  Namespace sizes
+    are running totals, so checking a namespace doesn't scan it.
+    """
+    limit = limit or config.KV_EXPIRE_BATCH
+    evicted = 0
+    for namespace, budget in config.KV_NAMESPACE_BUDGETS.items():
+        excess = namespace_bytes.get(namespace, 0) - budget
+        if excess <= 0:
+            continue
+        victims = []
+        with closing(conn.execute('SELECT key, size FROM kv WHERE namespace = ? ORDER BY accesstime LIMIT ?',
+                                  (namespace, limit - evicted))) as cursor:
+            for key, size in cursor:
+                victims.append(key)
+                excess -= size or 0
+                if excess <= 0:
+                    break
+        _evict(victims, 'budget')
+        evicted += len(victims)
+        if evicted >= limit:
+            break
+    return evicted
+
+
+def _evict(keys, reason):
+    if not keys:
+        return
+    removed = _stored_sizes(keys)
+    conn.executemany('DELETE FROM kv WHERE key = ?', [(key,) for key in keys])
+    conn.commit()
+    _forget_sizes(removed)
+    for key in keys:
+        value_cache.invalidate(key)
+    for namespace, _ in removed.values():
+        counts = evictions.setdefault(namespace, dict(idle=0, expired=0, budget=0))
+        counts[reason] += 1
+
+
+def _stored_sizes(keys):
+    """key -> (namespace, size) of the stored rows among `keys`."""
+    sizes = dict()
+    keys = list(keys)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        with closing(conn.execute('SELECT key, namespace, size FROM kv WHERE key IN ({})'
+                                  .format(', '.join('?' * len(chunk))), chunk)) as cursor:
+            for key, namespace, size in cursor:
+                sizes[key] = (namespace, size or 0)
+    return sizes
+
+
+def _forget_sizes(removed):
+    for namespace, size in removed.values():
+        namespace_bytes[namespace] = namespace_bytes.get(namespace, 0) - size
+
+
+def _namespace(key):
+    """`cache` for `cache:tree:...`; keys without a prefix are in ''."""
+    return key.partition(':')[0] if ':' in key else ''
+
+
 # Initialize Database
 _db_file = str(pathlib.Path(__file__).parent.resolve() / 'db.sqlite3')
 if not os.path.exists(_db_file):
@@ -77,16 +216,216 @@ if not os.path.exists(_db_file):
         os.rename(_old_db_file, _db_file)
 
 conn = sqlite3.connect(_db_file)
+# WAL lets a commit append to the log instead of rewriting the database, and
+# with synchronous=NORMAL only checkpoints wait on fsync.
+conn.execute('PRAGMA journal_mode=WAL;')
+conn.execute('PRAGMA synchronous=NORMAL;')
+conn.execute('PRAGMA cache_size=-{};'.format(config.KV_CACHE_SIZE_KB))
+conn.execute('PRAGMA temp_store=MEMORY;')
 
 conn.execute('''CREATE TABLE IF NOT EXISTS kv (
     key TEXT PRIMARY KEY,
-    value TEXT
+    value TEXT,
+    namespace TEXT,
+    accesstime INTEGER,
+    expires INTEGER,
+    size INTEGER
 );''')
 
-conn.execute('''CREATE TABLE IF NOT EXISTS kvaccess (key TEXT PRIMARY KEY, accesstime integer);''')
+def _migrate():
+    columns = [r[1] for r in conn.execute('PRAGMA table_info(kv);')]
+    if 'namespace' not in columns:
+        # access times used to live in a separate kvaccess table.
+        conn.execute('ALTER TABLE kv ADD COLUMN namespace TEXT;')
+        conn.execute('ALTER TABLE kv ADD COLUMN accesstime INTEGER;')
+        conn.execute('ALTER TABLE kv ADD COLUMN expires INTEGER;')
+        conn.execute("""UPDATE kv SET namespace = CASE WHEN instr(key, ':') > 0
+                        THEN substr(key, 1, instr(key, ':') - 1) ELSE '' END;""")
+        conn.execute('UPDATE kv SET accesstime = ?;', (int(time.time()),))
+        if conn.execute("SELECT name FROM sqlite_master WHERE name = 'kvaccess';").fetchone():
+            conn.execute("""UPDATE kv SET accesstime = (SELECT accesstime FROM kvaccess WHERE kvaccess.key = kv.key)
+                            WHERE key IN (SELECT key FROM kvaccess);""")
+            conn.execute('DROP TABLE kvaccess;')
+    if 'size' not in columns:
+        conn.execute('ALTER TABLE kv ADD COLUMN size INTEGER;')
+        conn.execute('UPDATE kv SET size = length(CAST(value AS BLOB));')
+    conn.commit()
+
+
+_migrate()
+# (namespace, accesstime, size) serves both LRU order and budget sums.
+conn.execute('DROP INDEX IF EXISTS kv_namespace_accesstime;')
+conn.execute('CREATE INDEX IF NOT EXISTS kv_lru ON kv (namespace, accesstime, size);')
+conn.execute('CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires) WHERE expires IS NOT NULL;')
 
 access_times = dict()
 
+# eviction counts by namespace and reason, since the add-in started.
+evictions = dict()
+# stored bytes per namespace, kept up to date by every write and delete.
+namespace_bytes = dict()
+with closing(conn.execute('SELECT namespace, COALESCE(SUM(size), 0) FROM kv GROUP BY namespace')) as _cursor:
+    namespace_bytes.update(_cursor)
+
+
+_MISSING = object()
+
+
+class ValueCache(object):
+    """
+    Serialized kv values kept in memory, least recently used first out once
+    there are more than `max_entries` of them or their size passes
+    `max_bytes`.  Absent keys are cached too, as None.  Only JSON text is
+    kept, so every hit decodes into a fresh object that callers may change.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING and entry[2] is not None and entry[2] <= time.time():
+            self.invalidate(key)
+            entry = _MISSING
+        if entry is _MISSING:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size, expires=None):
+        self.invalidate(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size, expires)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.size -= evicted
+
+    def invalidate(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def invalidate_pattern(self, pattern):
+        matches = _like_re(pattern).match
+        for key in [k for k in self._entries if matches(k)]:
+            self.invalidate(key)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    entries=len(self._entries), bytes=self.size)
+
+
+def _like_re(pattern):
+    """Regex equivalent of an SQLite LIKE pattern (case-insensitive, no ESCAPE)."""
+    parts = ('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+    return re.compile(r'(?s){}\Z'.format(''.join(parts)), re.IGNORECASE)
+
+
+value_cache = ValueCache(config.KV_MEMORY_CACHE_ENTRIES, config.KV_MEMORY_CACHE_BYTES)
+
+# Writes waiting to be committed in write-behind mode: key -> (serialized
+# value, or None for a delete; expiry time).
+_pending = OrderedDict()
+_pending_since = None
+
+
+def _write(rows):
+    """Apply (key, serialized value or None, expires) rows, now or write-behind."""
+    global _pending_since
+    if not config.KV_WRITE_BEHIND:
+        _apply(rows)
+        conn.commit()
+        return
+    if not _pending:
+        _pending_since = time.time()
+        _schedule(config.KV_WRITE_BEHIND_DELAY)
+    for key, value, expires in rows:
+        _pending.pop(key, None)
+        _pending[key] = (value, expires)
+
+
+# Large values are stored zlib compressed, as a BLOB starting with this
+# marker and the uncompressed length.  Anything stored as TEXT is plain JSON,
+# which keeps rows written before compression existed readable.
+_COMPRESSED = b'z1'
+_compressed_header = struct.Struct('>2sI')
+
+
+def _encode_value(text):
+    """Return the value to store for JSON `text`, and its size in bytes."""
+    data = text.encode('utf8')
+    if len(data) < config.KV_COMPRESS_MIN_BYTES:
+        return text, len(data)
+    packed = zlib.compress(data, config.KV_COMPRESS_LEVEL)
+    if len(packed) + _compressed_header.size >= len(data):
+        return text, len(data)
+    stored = _compressed_header.pack(_COMPRESSED, len(data)) + packed
+    return sqlite3.Binary(stored), len(stored)
+
+
+def _decode_value(stored):
+    if not isinstance(stored, bytes):
+        return stored
+    marker, _ = _compressed_header.unpack_from(stored)
+    if marker != _COMPRESSED:
+        raise ValueError('Unknown kv value format {!r}'.format(marker))
+    return zlib.decompress(stored[_compressed_header.size:]).decode('utf8')
+
+
+# (key prefix, callback) pairs; see on_set.
+_set_listeners = []
+
+
+def on_set(prefix, callback):
+    """
+    Call `callback(key, text)` with the JSON text of every value stored under
+    a key starting with `prefix`, in the transaction that stores it.
+    """
+    _set_listeners.append((prefix, callback))
+
+
+def _apply(rows):
+    now = int(time.time())
+    # rows being replaced or deleted no longer count towards their namespace.
+    _forget_sizes(_stored_sizes(key for key, _, _ in rows))
+    inserts = []
+    for key, value, expires in rows:
+        if value is not None:
+            stored, size = _encode_value(value)
+            namespace = _namespace(key)
+            inserts.append((key, stored, namespace, now, expires, size))
+            namespace_bytes[namespace] = namespace_bytes.get(namespace, 0) + size
+            if namespace_bytes[namespace] > config.KV_NAMESPACE_BUDGETS.get(namespace, namespace_bytes[namespace]):
+                _schedule(config.KV_FLUSH_LATENCY)
+    conn.executemany('INSERT OR REPLACE INTO kv (key, value, namespace, accesstime, expires, size) VALUES (?, ?, ?, ?, ?, ?)',
+                     inserts)
+    for prefix, callback in _set_listeners:
+        for key, value, _ in rows:
+            if value is not None and key.startswith(prefix):
+                callback(key, value)
+    conn.executemany('DELETE FROM kv WHERE key=?',
+                     [(k,) for k, v, _ in rows if v is None])
+
+
+def flush_writes():
+    """Commit any write-behind writes in a single transaction."""
+    if not _pending:
+        return
+    rows = [(key, value, expires) for key, (value, expires) in _pending.items()]
+    _pending.clear()
+    _apply(rows)
+    conn.commit()
+
+
 def _load_legacy_state():
     _legacy_save_file = str(pathlib.Path(__file__).parent.resolve() / '_save.json')
     if os.path.exists(_legacy_save_file):
@@ -99,61 +438,179 @@ def _load_legacy_state():
         os.unlink(_legacy_save_file)
 _load_legacy_state()
 
+def _cached(text, raw):
+    """Decode a value cache hit, or pass its text through with `raw`."""
+    if text is None:
+        return None
+    return RawJSON(text) if raw else json.loads(text)
+
+
+def _loaded(key, stored, expires, raw):
+    text = _decode_value(stored)
+    value_cache.put(key, text, len(text), expires)
+    return _cached(text, raw)
+
+
 @rpc.method
-def kv_get(key):
-    access_times[key] = int(time.time())
-    timerQueue.put(True)
-    with closing(conn.execute('SELECT value FROM kv WHERE key = ?', (key,))) as cursor:
+def kv_get(key, raw=False):
+    """
+    Value stored under `key`, or None.  With `raw`, the stored JSON text is
+    passed through to the RPC response without being decoded.
+    """
+    _touch(key)
+    value = value_cache.get(key)
+    if value is not _MISSING:
+        return _cached(value, raw)
+    if key in _pending:
+        flush_writes()
+    with closing(conn.execute('SELECT value, expires FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                              (key, int(time.time())))) as cursor:
         val = cursor.fetchone()
         if val:
-            return json.loads(val[0])
+            return _loaded(key, val[0], val[1], raw)
+        value_cache.put(key, None, 0)
 
 @rpc.method
-def kv_mget(keys=None, pattern=None):
-    q = 'SELECT key, value FROM kv WHERE key IN ({})'.format(', '.join('?' * len(keys)))
-    args = list(keys)
+def kv_mget(keys=None, pattern=None, raw=False):
+    result = dict()
+    keys = list(keys or ())
+    if not pattern:
+        # anything already in memory doesn't need to be read or decoded.
+        missing = []
+        for key in keys:
+            value = value_cache.get(key)
+            if value is _MISSING:
+                missing.append(key)
+            elif value is not None:
+                _touch(key)
+                result[key] = _cached(value, raw)
+        keys = missing
+        if not keys:
+            return result
+
+    conditions = []
+    args = [int(time.time())]
+    if keys:
+        conditions.append('key IN ({})'.format(', '.join('?' * len(keys))))
+        args += keys
     if pattern:
+        conditions.append('key LIKE ?')
         args.append(pattern)
-        q += ' OR key LIKE ?'
+    q = 'SELECT key, value, expires FROM kv WHERE (expires IS NULL OR expires > ?) AND ({})'.format(' OR '.join(conditions))
+    if _pending and (pattern or any(k in _pending for k in keys)):
+        flush_writes()
 
-    with closing(conn.execute(q, keys)) as cursor:
-        result = dict()
+    with closing(conn.execute(q, args)) as cursor:
         for row in cursor.fetchall():
-            access_times[row[0]] = time.time()
-            result[row[0]] = json.loads(row[1])
-        timerQueue.put(True)
+            _touch(row[0])
+            value = value_cache.get(row[0]) if pattern else None
+            if value is _MISSING or value is None:
+                result[row[0]] = _loaded(row[0], row[1], row[2], raw)
+            else:
+                result[row[0]] = _cached(value, raw)
+        for key in keys:
+            if key not in result:
+                value_cache.put(key, None, 0)
         return result
 
 @rpc.method
 def kv_keys(pattern=None):
-    query = "SELECT key FROM kv";
-    params = ()
+    flush_writes()
+    # rows past their ttl are hidden until the expiry batch deletes them.
+    query = "SELECT key FROM kv WHERE (expires IS NULL OR expires > ?)";
+    params = (int(time.time()),)
     if pattern:
-        query = f'{query} WHERE key LIKE ?'
-        params = (pattern,)
+        query = f'{query} AND key LIKE ?'
+        params += (pattern,)
     with closing(conn.execute(query, params)) as cursor:
         return [r[0] for r in cursor.fetchall()]
 
+def _serialize(value, raw):
+    if not raw:
+        return json.dumps(value)
+    # raw text is spliced into responses verbatim, so it has to be valid.
+    if not isinstance(value, str):
+        raise InvalidParametersException('raw values must be strings of JSON text')
+    try:
+        json.loads(value)
+    except ValueError as ex:
+        raise InvalidParametersException('invalid JSON text: {}'.format(ex))
+    return value
+
 @rpc.method
-def kv_set(key, value):
-    conn.execute('INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)', (key, json.dumps(value)))
-    conn.commit()
+def kv_set(key, value, raw=False, ttl=None):
+    """
+    Store `value` under `key`, for `ttl` seconds if given.  With `raw`,
+    `value` is a string of JSON text and is stored as is, without a
+    decode/encode round trip.
+    """
+    expires = int(time.time() + ttl) if ttl else None
+    serialized = _serialize(value, raw)
+    value_cache.put(key, serialized, len(serialized), expires)
+    _write([(key, serialized, expires)])
 
 @rpc.method
-def kv_mset(obj):
-    rows = [(k, json.dumps(v)) for k, v in obj.items()]
-    conn.executemany('INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)', rows)
-    conn.commit()
+def kv_mset(obj, raw=False, ttl=None):
+    expires = int(time.time() + ttl) if ttl else None
+    # serialize everything first: one invalid value stores none of them.
+    rows = [(key, _serialize(value, raw), expires) for key, value in obj.items()]
+    for key, serialized, _ in rows:
+        value_cache.put(key, serialized, len(serialized), expires)
+    _write(rows)
 
 @rpc.method
 def kv_del(key):
-    conn.execute('DELETE FROM kv WHERE key=?',(key,))
-    conn.commit()
+    value_cache.invalidate(key)
+    _write([(key, None, None)])
 
 @rpc.method
 def kv_mdel(keys=None, pattern=None):
     if keys:
-        conn.execute('DELETE FROM kv WHERE key IN ({})'.format(', '.join('?' * len(keys))), keys)
+        for key in keys:
+            value_cache.invalidate(key)
+        _write([(k, None, None) for k in keys])
     if pattern:
+        # a pattern can match pending keys, settle those first.
+        flush_writes()
+        value_cache.invalidate_pattern(pattern)
+        with closing(conn.execute('SELECT key, namespace, size FROM kv WHERE key LIKE ?', (pattern,))) as cursor:
+            removed = dict((key, (namespace, size or 0)) for key, namespace, size in cursor)
         conn.execute('DELETE FROM kv WHERE key LIKE ?', (pattern,))
-    conn.commit()
+        conn.commit()
+        _forget_sizes(removed)
+
+@rpc.method
+def kv_cache_stats():
+    """Hit/miss counters and current size of the in-memory value cache."""
+    return value_cache.stats()
+
+@rpc.method
+def kv_storage_stats():
+    """How much space kv values take on disk, and what compression saves."""
+    stats = dict(rows=0, compressed_rows=0, stored_bytes=0, uncompressed_bytes=0)
+    with closing(conn.execute('SELECT COUNT(*), COALESCE(SUM(length(value)), 0) FROM kv')) as cursor:
+        stats['rows'], stats['stored_bytes'] = cursor.fetchone()
+    stats['uncompressed_bytes'] = stats['stored_bytes']
+    query = "SELECT length(value), substr(value, 1, ?) FROM kv WHERE typeof(value) = 'blob'"
+    with closing(conn.execute(query, (_compressed_header.size,))) as cursor:
+        for stored, header in cursor:
+            marker, size = _compressed_header.unpack(header)
+            if marker == _COMPRESSED:
+                stats['compressed_rows'] += 1
+                stats['uncompressed_bytes'] += size - stored
+    stats['saved_bytes'] = stats['uncompressed_bytes'] - stats['stored_bytes']
+    return stats
+
+@rpc.method
+def kv_usage():
+    """Rows and bytes per namespace, with budgets and eviction counts."""
+    usage = dict()
+    with closing(conn.execute('SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM kv GROUP BY namespace')) as cursor:
+        for namespace, rows, size in cursor:
+            usage[namespace] = dict(rows=rows, bytes=size)
+    for namespace in set(config.KV_NAMESPACE_BUDGETS) | set(evictions):
+        usage.setdefault(namespace, dict(rows=0, bytes=0))
+    for namespace, entry in usage.items():
+        entry['budget'] = config.KV_NAMESPACE_BUDGETS.get(namespace)
+        entry['evictions'] = evictions.get(namespace, dict(idle=0, expired=0, budget=0))
+    return usage
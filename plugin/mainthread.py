@@ -0,0 +1,41 @@
+import queue
+from . import fusion360utils as futil
+
+# Fusion's API may only be used from the main (UI) thread.  Worker threads
+# queue callables here and fire a custom event; the event handler runs them
+# on the main thread.
+EVENT_ID = 'ConstructMainThreadEvent'
+
+mainEvent = None
+callQueue = queue.Queue()
+
+
+def start(app):
+    global mainEvent
+    mainEvent = app.registerCustomEvent(EVENT_ID)
+    futil.add_handler(mainEvent, on_main_thread)
+
+
+def stop():
+    global mainEvent
+    if mainEvent:
+        futil.app.unregisterCustomEvent(EVENT_ID)
+        mainEvent = None
+
+
+def call_soon(func, *args):
+    """Run `func(*args)` on the main thread; safe to call from any thread."""
+    callQueue.put((func, args))
+    futil.app.fireCustomEvent(EVENT_ID, '')
+
+
+def on_main_thread(event):
+    while True:
+        try:
+            func, args = callQueue.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            func(*args)
+        except:
+            futil.handle_error(getattr(func, '__name__', 'call_soon'))
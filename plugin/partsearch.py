@@ -0,0 +1,222 @@
+import re
+import json
+import time
+import sqlite3
+from contextlib import closing
+from .rpc import rpc
+from .jsonrpcserver import RpcException
+from . import kv
+from .kv import conn
+from . import fusion360utils as futil
+
+# Full text index over the model files of stored repository trees (see
+# repotree), so parts can be found across collections without walking the
+# merged tree in the palette.  One document per file; the name and folder
+# metadata come from the palette's cache:meta:<tree sha> entries, which map
+# part names to metadata for the folder with that tree sha.
+conn.execute('''CREATE TABLE IF NOT EXISTS part_doc (
+    id INTEGER PRIMARY KEY,
+    repo TEXT,
+    branch TEXT,
+    path TEXT,
+    part TEXT,
+    name TEXT,
+    parent TEXT,
+    parent_sha TEXT,
+    UNIQUE (repo, branch, path)
+);''')
+
+conn.execute('CREATE INDEX IF NOT EXISTS part_doc_parent ON part_doc (repo, branch, parent);')
+conn.execute('CREATE INDEX IF NOT EXISTS part_doc_parent_sha ON part_doc (parent_sha);')
+
+
+def _create_index():
+    """Create the FTS5 table; False if this SQLite is built without FTS5."""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS part_search USING fts5 (name, path, meta, prefix='2 3');")
+    except sqlite3.OperationalError as ex:
+        futil.log('Part search disabled, SQLite has no FTS5: {}'.format(ex))
+        conn.rollback()
+        return False
+    # rank by bm25, weighting name over folder path over metadata.
+    conn.execute("INSERT INTO part_search (part_search, rank) VALUES ('rank', 'bm25(10.0, 2.0, 1.0)');")
+    conn.commit()
+    return True
+
+
+ENABLED = _create_index()
+
+META_PREFIX = 'cache:meta:'
+PART_EXTENSIONS = ('.step', '.stp', '.f3d', '.svg', '.dxf')
+_stem_re = re.compile(r'^(.*?)(\.[^.]*)?$')
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def _is_part(node):
+    return node.get('type') == 'blob' and node['path'].lower().endswith(PART_EXTENSIONS)
+
+
+def _stem(path):
+    return _stem_re.match(path).group(1)
+
+
+def _meta_text(meta):
+    """Flatten the values of a metadata object into searchable text."""
+    if isinstance(meta, dict):
+        return ' '.join(_meta_text(v) for v in meta.values())
+    if isinstance(meta, list):
+        return ' '.join(_meta_text(v) for v in meta)
+    if meta is None or isinstance(meta, bool):
+        return ''
+    return str(meta)
+
+
+def _folder_meta(sha, memo):
+    # read the row itself: this runs inside tree_update's transaction, which
+    # kv_get could commit (by flushing writes) and would count as a read.
+    if sha not in memo:
+        meta = None
+        if sha:
+            with closing(conn.execute('SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                      (META_PREFIX + sha, int(time.time())))) as cursor:
+                row = cursor.fetchone()
+            if row is not None:
+                meta = json.loads(kv._decode_value(row[0]))
+        memo[sha] = meta if isinstance(meta, dict) else {}
+    return memo[sha]
+
+
+def _delete_docs(where, params):
+    conn.execute('DELETE FROM part_search WHERE rowid IN (SELECT id FROM part_doc WHERE {})'.format(where), params)
+    conn.execute('DELETE FROM part_doc WHERE {}'.format(where), params)
+
+
+def _folder_shas(repo, branch, root_sha, folders):
+    shas = dict((f, root_sha) for f in folders if f == '')
+    folders = [f for f in folders if f]
+    for i in range(0, len(folders), 500):
+        chunk = folders[i:i + 500]
+        with closing(conn.execute('SELECT path, sha FROM repo_tree_node WHERE repo = ? AND branch = ? AND path IN ({})'
+                                  .format(', '.join('?' * len(chunk))), [repo, branch] + chunk)) as cursor:
+            shas.update(cursor)
+    return shas
+
+
+def index_nodes(repo, branch, root_sha, upsert, delete):
+    """
+    Update the index after repotree stored `upsert` and removed `delete`
+    for `repo`/`branch`.  Runs in the caller's transaction.
+    """
+    if not ENABLED:
+        return
+    for path in delete:
+        path = path.strip('/')
+        _delete_docs('repo = ? AND branch = ? AND (path = ? OR (path >= ? AND path < ?))',
+                     (repo, branch, path, path + '/', path + '0'))
+
+    # a folder whose sha changed has a new cache:meta key for its children.
+    folders = set([''] + [n['path'].strip('/') for n in upsert if n.get('type') == 'tree'])
+    parts = [n['path'].strip('/') for n in upsert if _is_part(n)]
+    folders.update(p.rpartition('/')[0] for p in parts)
+    folder_shas = _folder_shas(repo, branch, root_sha, list(folders))
+    memo = dict()
+
+    for path in parts:
+        parent = path.rpartition('/')[0]
+        part = _stem(path)
+        name = part.rpartition('/')[2]
+        cursor = conn.execute('INSERT OR IGNORE INTO part_doc (repo, branch, path, part, name, parent, parent_sha) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (repo, branch, path, part, name, parent, folder_shas.get(parent)))
+        if not cursor.rowcount:
+            # already indexed; only its sha changed.
+            continue
+        meta = _folder_meta(folder_shas.get(parent), memo).get(name)
+        conn.execute('INSERT INTO part_search (rowid, name, path, meta) VALUES (?, ?, ?, ?)',
+                     (cursor.lastrowid, name, part.replace('/', ' '), _meta_text(meta)))
+
+    for folder, sha in folder_shas.items():
+        with closing(conn.execute('SELECT id, name FROM part_doc WHERE repo = ? AND branch = ? AND parent = ? AND parent_sha IS NOT ?',
+                                  (repo, branch, folder, sha))) as cursor:
+            stale = cursor.fetchall()
+        if stale:
+            conn.executemany('UPDATE part_doc SET parent_sha = ? WHERE id = ?', [(sha, i) for i, _ in stale])
+            _set_meta(stale, _folder_meta(sha, memo))
+
+
+def _set_meta(docs, folder_meta):
+    conn.executemany('UPDATE part_search SET meta = ? WHERE rowid = ?',
+                     [(_meta_text(folder_meta.get(name)), i) for i, name in docs])
+
+
+def forget(repo, branch=None):
+    if not ENABLED:
+        return
+    if branch is None:
+        _delete_docs('repo = ?', (repo,))
+    else:
+        _delete_docs('repo = ? AND branch = ?', (repo, branch))
+
+
+def _on_meta_set(key, text):
+    # runs inside kv_set: a problem with the index must not fail the write.
+    try:
+        folder_meta = json.loads(text)
+        if not isinstance(folder_meta, dict):
+            folder_meta = {}
+        # merged folders use the shas of all their trees, joined with ':'.
+        for sha in key[len(META_PREFIX):].split(':'):
+            with closing(conn.execute('SELECT id, name FROM part_doc WHERE parent_sha = ?', (sha,))) as cursor:
+                docs = cursor.fetchall()
+            _set_meta(docs, folder_meta)
+    except Exception as ex:
+        futil.log('Indexing metadata of {} failed: {!r}'.format(key, ex))
+
+
+if ENABLED:
+    kv.on_set(META_PREFIX, _on_meta_set)
+
+
+def backfill():
+    """Index trees stored before the index existed."""
+    if not ENABLED:
+        return
+    with closing(conn.execute('SELECT 1 FROM part_doc LIMIT 1')) as cursor:
+        if cursor.fetchone():
+            return
+    with closing(conn.execute('SELECT repo, branch, sha FROM repo_tree')) as cursor:
+        trees = cursor.fetchall()
+    for repo, branch, sha in trees:
+        with closing(conn.execute('SELECT path, type, sha FROM repo_tree_node WHERE repo = ? AND branch = ?',
+                                  (repo, branch))) as cursor:
+            nodes = [dict(path=r[0], type=r[1], sha=r[2]) for r in cursor]
+        index_nodes(repo, branch, sha, nodes, ())
+    conn.commit()
+
+
+def _match_query(query):
+    """Turn free text into an FTS5 query: every word, as a prefix."""
+    words = _word_re.findall(query)
+    return ' '.join('"{}"*'.format(w) for w in words)
+
+
+@rpc.method
+def search_parts(query, limit=50, offset=0):
+    """
+    Parts whose name, folder path or metadata match every word of `query`,
+    best matches first.  Files of one part (e.g. a .step and a .f3d with the
+    same name) are returned as a single hit.
+    """
+    if not ENABLED:
+        raise RpcException(1, 'Part search needs SQLite with FTS5')
+    match = _match_query(query)
+    if not match:
+        return []
+    q = '''SELECT d.repo, d.branch, d.part, d.name, group_concat(d.path, char(10)), MIN(hits.score) AS score
+           FROM (SELECT rowid AS id, rank AS score FROM part_search WHERE part_search MATCH ?) hits
+           JOIN part_doc d ON d.id = hits.id
+           GROUP BY d.repo, d.branch, d.part
+           ORDER BY score LIMIT ? OFFSET ?'''
+    with closing(conn.execute(q, (match, limit, offset))) as cursor:
+        return [dict(repo=r[0], branch=r[1], path=r[2], name=r[3], files=sorted(r[4].split('\n')), score=-r[5])
+                for r in cursor]
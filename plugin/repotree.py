@@ -0,0 +1,142 @@
+import time
+from contextlib import closing
+from .rpc import rpc
+from .kv import conn
+from . import partsearch
+
+# GitHub repository trees, one row per node, so a new tree sha only rewrites
+# the nodes that changed and browsing a folder only reads that folder.  Node
+# dicts use GitHub's tree entry fields (path, type, sha, mode, size).
+conn.execute('''CREATE TABLE IF NOT EXISTS repo_tree (
+    repo TEXT,
+    branch TEXT,
+    sha TEXT,
+    updated INTEGER,
+    PRIMARY KEY (repo, branch)
+);''')
+
+conn.execute('''CREATE TABLE IF NOT EXISTS repo_tree_node (
+    repo TEXT,
+    branch TEXT,
+    path TEXT,
+    parent TEXT,
+    type TEXT,
+    sha TEXT,
+    mode TEXT,
+    size INTEGER,
+    PRIMARY KEY (repo, branch, path)
+) WITHOUT ROWID;''')
+
+conn.execute('CREATE INDEX IF NOT EXISTS repo_tree_node_parent ON repo_tree_node (repo, branch, parent);')
+partsearch.backfill()
+
+_FIELDS = ('path', 'type', 'sha', 'mode', 'size')
+
+
+def _parent(path):
+    return path.rpartition('/')[0]
+
+
+def _row(repo, branch, node):
+    path = node['path'].strip('/')
+    return (repo, branch, path, _parent(path), node.get('type'), node.get('sha'), node.get('mode'), node.get('size'))
+
+
+def _node(row):
+    return dict(zip(_FIELDS, row))
+
+
+def _subtree_range(path):
+    # every path below `path` sorts between 'path/' and 'path0'.
+    return path + '/', path + '0'
+
+
+def _delete(repo, branch, paths):
+    for path in paths:
+        path = path.strip('/')
+        low, high = _subtree_range(path)
+        conn.execute('DELETE FROM repo_tree_node WHERE repo = ? AND branch = ? AND (path = ? OR (path >= ? AND path < ?))',
+                     (repo, branch, path, low, high))
+
+
+def _diff(repo, branch, entries):
+    """Split a full tree listing into (changed nodes, removed paths) against what's stored."""
+    with closing(conn.execute('SELECT path, type, sha, mode FROM repo_tree_node WHERE repo = ? AND branch = ?',
+                              (repo, branch))) as cursor:
+        stored = dict((r[0], r[1:]) for r in cursor)
+    upsert = []
+    for node in entries:
+        path = node['path'].strip('/')
+        if stored.pop(path, None) != (node.get('type'), node.get('sha'), node.get('mode')):
+            upsert.append(node)
+    return upsert, list(stored)
+
+
+@rpc.method
+def tree_sha(repo, branch):
+    """Tree sha stored for `repo`/`branch`, or None."""
+    with closing(conn.execute('SELECT sha FROM repo_tree WHERE repo = ? AND branch = ?', (repo, branch))) as cursor:
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+@rpc.method
+def tree_update(repo, branch, sha, entries=None, upsert=None, delete=None):
+    """
+    Bring the stored tree of `repo`/`branch` up to tree `sha`.  Either pass
+    the full recursive listing as `entries`, which is diffed against the
+    stored nodes, or a diff: nodes to `upsert` and paths to `delete` (with
+    everything below them).  Only changed rows are written.
+    """
+    upsert = list(upsert or ())
+    delete = list(delete or ())
+    if entries is not None:
+        upsert, delete = _diff(repo, branch, entries)
+    _delete(repo, branch, delete)
+    conn.executemany('INSERT OR REPLACE INTO repo_tree_node (repo, branch, path, parent, type, sha, mode, size) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     [_row(repo, branch, node) for node in upsert])
+    partsearch.index_nodes(repo, branch, sha, upsert, delete)
+    conn.execute('INSERT OR REPLACE INTO repo_tree (repo, branch, sha, updated) VALUES (?, ?, ?, ?)',
+                 (repo, branch, sha, int(time.time())))
+    conn.commit()
+    return dict(sha=sha, upserted=len(upsert), deleted=len(delete))
+
+
+@rpc.method
+def tree_get(repo, branch, path='', recursive=False):
+    """
+    Nodes directly inside `path` ('' for the root) of the stored tree, or
+    everything below it with `recursive`.  Returns None if the branch isn't
+    stored.
+    """
+    sha = tree_sha(repo, branch)
+    if sha is None:
+        return None
+    path = path.strip('/')
+    if recursive and path:
+        low, high = _subtree_range(path)
+        query = 'SELECT path, type, sha, mode, size FROM repo_tree_node WHERE repo = ? AND branch = ? AND path >= ? AND path < ?'
+        params = (repo, branch, low, high)
+    elif recursive:
+        query = 'SELECT path, type, sha, mode, size FROM repo_tree_node WHERE repo = ? AND branch = ?'
+        params = (repo, branch)
+    else:
+        query = 'SELECT path, type, sha, mode, size FROM repo_tree_node WHERE repo = ? AND branch = ? AND parent = ?'
+        params = (repo, branch, path)
+    with closing(conn.execute(query + ' ORDER BY path', params)) as cursor:
+        return dict(sha=sha, path=path, tree=[_node(r) for r in cursor])
+
+
+@rpc.method
+def tree_forget(repo, branch=None):
+    """Drop the stored tree of `repo`/`branch`, or of every branch of `repo`."""
+    if branch is None:
+        conn.execute('DELETE FROM repo_tree_node WHERE repo = ?', (repo,))
+        conn.execute('DELETE FROM repo_tree WHERE repo = ?', (repo,))
+        partsearch.forget(repo)
+    else:
+        conn.execute('DELETE FROM repo_tree_node WHERE repo = ? AND branch = ?', (repo, branch))
+        conn.execute('DELETE FROM repo_tree WHERE repo = ? AND branch = ?', (repo, branch))
+        partsearch.forget(repo, branch)
+    conn.commit()
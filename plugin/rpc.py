@@ -1,13 +1,67 @@
 import tempfile
 import os
+import pathlib
+import json
 import adsk.core, adsk.fusion
 import base64
+import functools
+import threading
+import collections
 from . import importing
-from .util import download, create_import_options
+from . import spool
+from . import mainthread
+from . import exportcache
+from . import scratchdoc
+from .util import create_import_options, content_key, is_cached, fetch_async, inflight
+from .blobcache import blob_cache
 from . import fusion360utils as futil
+from . import config
 from . import jsonrpcserver
 
-rpc = jsonrpcserver.Service()
+
+def send_to_palette(body):
+    palette = futil.ui.palettes.itemById(config.construct_palette_id)
+    if palette:
+        palette.sendInfoToHTML('jsonrpc', body)
+
+
+# deferred responses may resolve on a worker thread, the palette can only be
+# talked to from the main one.
+rpc = jsonrpcserver.Service(
+    responder=lambda body: mainthread.call_soon(send_to_palette, body),
+    profile_dir=str(pathlib.Path(__file__).parent.resolve() / 'profiles'))
+
+
+def notify(method, **params):
+    """Send a JSON-RPC notification to the palette, if it's open."""
+    send_to_palette(json.dumps(jsonrpcserver.Notification(method, params).as_dict()))
+
+
+def download_deferred(url, token, finish, filename=None, extension='', sha=None, reject=True):
+    """
+    Download `url` on the download pool, then call `finish(file_path)` on the
+    main thread.  Returns a Deferred that resolves with whatever `finish`
+    returns, so the RPC caller gets its response without the UI thread ever
+    waiting on the network.  A failure rejects the Deferred or, for callers
+    that expect null on failure, with `reject` False resolves it with None.
+    """
+    deferred = jsonrpcserver.Deferred()
+    filename = '{}.{}'.format(filename or 'model', extension)
+
+    def on_main_thread(future):
+        try:
+            with blob_cache.checkout(future.result(), filename) as file_path:
+                deferred.resolve(finish(file_path))
+        except Exception as ex:
+            futil.log('Deferred download of {} failed: {}'.format(url, ex))
+            if reject:
+                deferred.reject(ex)
+            else:
+                deferred.resolve(None)
+
+    fetch_async(url, token, sha).add_done_callback(
+        lambda future: mainthread.call_soon(on_main_thread, future))
+    return deferred
 
 
 @rpc.method
@@ -21,93 +75,202 @@ def close():
     palette.isVisible = False
 
 
-@rpc.method
-def get_screenshot(width=256, height=256, transparent=False, antialias=True):
+def save_viewport(fname, width=256, height=256, transparent=False, antialias=True):
+    options = adsk.core.SaveImageFileOptions.create(fname)
+    options.height = height
+    options.width = width
+    options.isBackgroundTransparent = transparent
+    options.antialias = antialias
+    futil.app.activeViewport.saveAsImageFileWithOptions(options)
+
+
+def capture_png(width=256, height=256, transparent=False, antialias=True):
+    """Save the active viewport as a PNG and return its bytes."""
     with tempfile.TemporaryDirectory() as tmp_dir:
         fname = os.path.join(tmp_dir, 'thumbnail.png')
-        options = adsk.core.SaveImageFileOptions.create(fname)
-        options.height = height
-        options.width = width
-        options.isBackgroundTransparent = transparent
-        options.antialias = antialias
-        futil.app.activeViewport.saveAsImageFileWithOptions(options)
+        save_viewport(fname, width, height, transparent, antialias)
         with open(fname, 'rb') as f:
-            return 'data:image/png;base64,{}'.format(base64.b64encode(f.read()).decode('utf8'))
+            return f.read()
+
+
+def png_data_uri(png):
+    return 'data:image/png;base64,{}'.format(base64.b64encode(png).decode('utf8'))
 
 
 @rpc.method
-def autothumb(url, content_type, token, width=256, height=256, transparent=False, antialias=True):
-    screenshot = None
-    importManager = futil.app.importManager
-    with download(url, token, extension=content_type) as file_path:
-        options = create_import_options(file_path, content_type)
-        doc = None
+def get_screenshot(width=256, height=256, transparent=False, antialias=True, as_handle=False):
+    if as_handle:
+        handle, fname = spool.reserve('.png')
+        save_viewport(fname, width, height, transparent, antialias)
+        return spool.describe(handle)
+    return png_data_uri(capture_png(width, height, transparent, antialias))
+
+
+def render_thumbnail(file_path, content_type, width=256, height=256, transparent=False, antialias=True):
+    """Import `file_path` into a scratch document and return a PNG of it, or None."""
+    png = None
+    if config.THUMBNAIL_SCRATCH_DOCUMENT:
         try:
-            doc = importManager.importToNewDocument(options)
-            screenshot = get_screenshot(256, 256, transparent=transparent, antialias=antialias)
-        except:
-            pass
-        finally:
-            if doc:
-                doc.close(False)
+            with scratchdoc.imported(file_path, content_type):
+                png = capture_png(width, height, transparent=transparent, antialias=antialias)
+        except Exception as ex:
+            futil.log('Rendering thumbnail of {} failed: {}'.format(file_path, ex))
+        return png
+
+    importManager = futil.app.importManager
+    options = create_import_options(file_path, content_type)
+    doc = None
+    try:
+        doc = importManager.importToNewDocument(options)
+        png = capture_png(width, height, transparent=transparent, antialias=antialias)
+    except:
+        pass
+    finally:
+        if doc:
+            doc.close(False)
 
-        return screenshot
+    return png
 
 
 @rpc.method
 def open_model(url, token, content_type=None, filename=None):
-    app = adsk.core.Application.get()
-    importManager = app.importManager
-
-    with download(url, token, filename=filename, extension=content_type) as file_path:
+    def finish(file_path):
         options = create_import_options(file_path, content_type)
-        importManager.importToNewDocument(options)
+        futil.app.importManager.importToNewDocument(options)
 
+    return download_deferred(url, token, finish, filename=filename, extension=content_type)
 
-@rpc.method
-def import_model(url, token, content_type=None, filename=None):
-    app = adsk.core.Application.get()
-    importManager = app.importManager
 
-    # Get active design
-    product = app.activeProduct
-    design = adsk.fusion.Design.cast(product)
+def import_file(file_path, content_type):
+    """Import a local step/f3d/svg file into the active design."""
+    # called once the file is local, so use whatever is active then.
+    design = adsk.fusion.Design.cast(futil.app.activeProduct)
     target = design.activeComponent
+    options = create_import_options(file_path, content_type)
+    if content_type == 'svg':
+        target = design.activeEditObject
+    futil.app.importManager.importToTarget(options, target)
+    exportcache.invalidate()
+
+
+@rpc.method
+def import_model(url, token, content_type=None, filename=None):
     if content_type in ('step', 'f3d', 'svg'):
-        with download(url, token, extension=content_type, filename=filename) as file_path:
-             options = create_import_options(file_path, content_type)
-             if content_type == 'svg':
-                 target = design.activeEditObject
-             importManager.importToTarget(options, target);
+        finish = functools.partial(import_file, content_type=content_type)
+        return download_deferred(url, token, finish, filename=filename, extension=content_type)
     elif content_type == 'dxf':
-        importing.set_importing(dict(url=url, token=token, extension=content_type, filename=filename))
+        # downloads while the user picks a plane in the Insert Sketch dialog.
+        importing.enqueue(url, token, content_type, filename)
         cmd = futil.app.userInterface.commandDefinitions.itemById('voronConstruct_InsertSketch')
         cmd.execute()
 
 
 @rpc.method
-def export_model(step=True, f3d=True):
+def export_model(step=True, f3d=True, as_handle=False):
+    """
+    Export the active component as STEP and/or F3D.  By default the files are
+    returned inline as data URIs; with `as_handle` each is left in the spool
+    and described by a handle to be pulled with `read_chunk` and `release`d.
+    """
     design = adsk.fusion.Design.cast(futil.app.activeProduct)
-    exportManager = design.exportManager
     comp = design.activeComponent
+    data = dict()
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        data = dict()
+    for fmt, wanted in (('step', step), ('f3d', f3d)):
+        if not wanted:
+            continue
+        path = exportcache.export(design, comp, fmt)
+        if as_handle:
+            data[fmt] = spool.describe(spool.add_file(path, '.' + fmt))
+        else:
+            with open(path, 'rb') as f:
+                data[fmt] = 'data:application/octet-stream;base64,{}'.format(base64.b64encode(f.read()).decode('utf8'))
+
+    data['name'] = comp.name
+
+    return data
 
-        if step:
-            fname = os.path.join(tmp_dir, 'model.step')
-            options = exportManager.createSTEPExportOptions(fname, comp)
-            exportManager.execute(options)
-            with open(fname, 'rb') as f:
-                data['step'] = 'data:application/octet-stream;base64,{}'.format(base64.b64encode(f.read()).decode('utf8'))
 
-        if f3d:
-            fname = os.path.join(tmp_dir, 'model.f3d')
-            options = exportManager.createFusionArchiveExportOptions(fname, comp)
-            exportManager.execute(options)
-            with open(fname, 'rb') as f:
-                data['f3d'] = 'data:application/octet-stream;base64,{}'.format(base64.b64encode(f.read()).decode('utf8'))
+@rpc.method
+def read_chunk(handle, offset=0, size=None):
+    """
+    Read up to `size` bytes (capped at SPOOL_MAX_CHUNK) of a spooled file from
+    `offset`.  Returns the base64 encoded bytes and whether the end was hit.
+    """
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise jsonrpcserver.InvalidParametersException('`offset` must be a non-negative integer')
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size <= 0):
+        raise jsonrpcserver.InvalidParametersException('`size` must be a positive integer')
+    try:
+        total = spool.describe(handle)['size']
+        chunk = spool.read(handle, offset, size)
+    except spool.InvalidHandle:
+        raise jsonrpcserver.InvalidParametersException('Unknown handle `{}`'.format(handle))
+    return dict(data=base64.b64encode(chunk).decode('utf8'),
+                offset=offset,
+                eof=offset + len(chunk) >= total)
+
 
-        data['name'] = comp.name
+@rpc.method
+def release(handle):
+    spool.release(handle)
 
-        return data
+
+# the last failure of each recently prefetched URL, oldest first.
+_prefetch_errors = collections.OrderedDict()
+_prefetch_errors_lock = threading.Lock()
+PREFETCH_ERRORS_MAX = 256
+
+
+def _prefetch_item(item):
+    if isinstance(item, dict):
+        return item['url'], item.get('sha')
+    return item, None
+
+
+def _prefetch_done(url, future):
+    with _prefetch_errors_lock:
+        _prefetch_errors.pop(url, None)
+        if not future.cancelled() and future.exception() is not None:
+            _prefetch_errors[url] = str(future.exception())
+            while len(_prefetch_errors) > PREFETCH_ERRORS_MAX:
+                _prefetch_errors.popitem(last=False)
+
+
+@rpc.method
+def prefetch(items, token):
+    """
+    Download `items` (blob URLs, or {url, sha} objects) into the local cache
+    in the background, so a later open/import doesn't wait on the network.
+    Returns the status of each item by URL.
+    """
+    status = dict()
+    for item in items:
+        url, sha = _prefetch_item(item)
+        if is_cached(url, sha):
+            status[url] = dict(status='cached')
+            continue
+        with _prefetch_errors_lock:
+            _prefetch_errors.pop(url, None)
+        future = fetch_async(url, token, sha)
+        future.add_done_callback(functools.partial(_prefetch_done, url))
+        status[url] = dict(status='pending')
+    return status
+
+
+@rpc.method
+def prefetch_status(items):
+    status = dict()
+    for item in items:
+        url, sha = _prefetch_item(item)
+        with _prefetch_errors_lock:
+            error = _prefetch_errors.get(url)
+        if inflight(url, sha) is not None:
+            status[url] = dict(status='pending')
+        elif error is not None:
+            status[url] = dict(status='error', error=error)
+        elif blob_cache.get(content_key(url, sha)) is not None:
+            status[url] = dict(status='cached')
+        else:
+            status[url] = dict(status='missing')
+    return status
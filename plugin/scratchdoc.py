@@ -0,0 +1,98 @@
+import time
+import threading
+import contextlib
+import adsk.core, adsk.fusion
+from . import config
+from . import mainthread
+from .util import create_import_options
+from . import fusion360utils as futil
+
+# One document reused for rendering thumbnails, instead of a new document
+# per model: each model goes into a fresh occurrence that is deleted again
+# after the capture.  The document that was active before is brought back
+# after every capture, so imports and exports never land in the scratch
+# design; the scratch document is closed once it has been idle for
+# THUMBNAIL_SCRATCH_IDLE seconds.
+_doc = None
+_previous = None
+_last_used = 0
+_idle_timer = None
+
+
+def _document():
+    global _doc, _previous
+    if _doc is None or not _doc.isValid:
+        _previous = futil.app.activeDocument
+        # the viewport can only be captured from a visible, active document.
+        _doc = futil.app.documents.add(adsk.core.DocumentTypes.FusionDesignDocumentType)
+        design = adsk.fusion.Design.cast(_doc.products.itemByProductType('DesignProductType'))
+        # no timeline, so nothing piles up from one model to the next.
+        design.designType = adsk.fusion.DesignTypes.DirectDesignType
+    elif futil.app.activeDocument != _doc:
+        _previous = futil.app.activeDocument
+        _doc.activate()
+    return _doc
+
+
+def _fit(viewport):
+    camera = viewport.camera
+    camera.viewOrientation = adsk.core.ViewOrientations.IsoTopRightViewOrientation
+    camera.isFitView = True
+    viewport.camera = camera
+    viewport.fit()
+
+
+@contextlib.contextmanager
+def imported(file_path, content_type):
+    """Show `file_path` alone in the active viewport of the scratch document."""
+    global _last_used
+    doc = _document()
+    design = adsk.fusion.Design.cast(doc.products.itemByProductType('DesignProductType'))
+    occurrence = design.rootComponent.occurrences.addNewComponent(adsk.core.Matrix3D.create())
+    try:
+        options = create_import_options(file_path, content_type)
+        futil.app.importManager.importToTarget(options, occurrence.component)
+        _fit(futil.app.activeViewport)
+        yield
+    finally:
+        occurrence.deleteMe()
+        if futil.app.activeDocument == doc and _previous is not None and _previous.isValid:
+            _previous.activate()
+        _last_used = time.time()
+        _schedule_close(config.THUMBNAIL_SCRATCH_IDLE)
+
+
+def _schedule_close(delay):
+    global _idle_timer
+    if _idle_timer is not None:
+        return
+    _idle_timer = threading.Timer(delay, mainthread.call_soon, (_close_if_idle,))
+    _idle_timer.daemon = True
+    _idle_timer.start()
+
+
+def _close_if_idle():
+    global _idle_timer
+    _idle_timer = None
+    idle = time.time() - _last_used
+    if idle < config.THUMBNAIL_SCRATCH_IDLE:
+        _schedule_close(config.THUMBNAIL_SCRATCH_IDLE - idle)
+    else:
+        close()
+
+
+def close():
+    """Close the scratch document, if it's open.  Main thread only."""
+    global _doc, _previous, _idle_timer
+    if _idle_timer is not None:
+        _idle_timer.cancel()
+        _idle_timer = None
+    doc, previous = _doc, _previous
+    _doc = _previous = None
+    if doc is None or not doc.isValid:
+        return
+    # only give focus back if the user is still looking at the scratch doc.
+    was_active = futil.app.activeDocument == doc
+    doc.close(False)
+    if was_active and previous is not None and previous.isValid:
+        previous.activate()
@@ -0,0 +1,74 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import pathlib
+import contextlib
+
+from . import config
+
+# Files handed to the palette by handle rather than inline in a response.
+# Handles don't outlive the add-in, so the directory is emptied on load.
+_spool_dir = str(pathlib.Path(__file__).parent.resolve() / config.SPOOL_DIR)
+_handle_re = re.compile(r'^[0-9a-f]{32}(\.[a-z0-9]+)?$')
+
+shutil.rmtree(_spool_dir, ignore_errors=True)
+os.makedirs(_spool_dir, exist_ok=True)
+
+
+class InvalidHandle(KeyError):
+    pass
+
+
+def _path(handle):
+    if not isinstance(handle, str) or not _handle_re.match(handle):
+        raise InvalidHandle(handle)
+    path = os.path.join(_spool_dir, handle)
+    if not os.path.exists(path):
+        raise InvalidHandle(handle)
+    return path
+
+
+def reserve(suffix=''):
+    """Return a new (handle, path) pair; the caller writes the file at `path`."""
+    expire()
+    handle = uuid.uuid4().hex + suffix
+    return handle, os.path.join(_spool_dir, handle)
+
+
+def add_file(path, suffix=''):
+    """Spool a copy of an existing file (a hard link where possible)."""
+    handle, spool_path = reserve(suffix)
+    try:
+        os.link(path, spool_path)
+    except OSError:
+        shutil.copyfile(path, spool_path)
+    return handle
+
+
+def describe(handle):
+    return dict(handle=handle, size=os.path.getsize(_path(handle)))
+
+
+def read(handle, offset=0, size=None):
+    size = min(size or config.SPOOL_MAX_CHUNK, config.SPOOL_MAX_CHUNK)
+    path = _path(handle)
+    os.utime(path)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def release(handle):
+    with contextlib.suppress(InvalidHandle, OSError):
+        os.unlink(_path(handle))
+
+
+def expire():
+    """Remove spooled files the palette hasn't touched within SPOOL_TTL."""
+    cutoff = time.time() - config.SPOOL_TTL
+    for entry in os.scandir(_spool_dir):
+        with contextlib.suppress(OSError):
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
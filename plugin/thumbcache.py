@@ -0,0 +1,53 @@
+import time
+import sqlite3
+from contextlib import closing
+from . import config
+from .kv import conn
+
+# Rendered thumbnails, stored as raw PNG bytes in the same database as the kv
+# store.  Keys include everything that affects the rendered image, so a hit
+# is always safe to reuse.
+conn.execute('''CREATE TABLE IF NOT EXISTS thumbnail (
+    key TEXT PRIMARY KEY,
+    png BLOB,
+    size INTEGER,
+    accesstime INTEGER
+);''')
+
+conn.execute('CREATE INDEX IF NOT EXISTS thumbnail_accesstime ON thumbnail (accesstime);')
+
+
+def thumbnail_key(sha, content_type, width, height, transparent, antialias):
+    return '{}:{}:{}x{}:{}:{}'.format(sha, content_type, width, height, int(bool(transparent)), int(bool(antialias)))
+
+
+def get(key):
+    with closing(conn.execute('SELECT png FROM thumbnail WHERE key = ?', (key,))) as cursor:
+        row = cursor.fetchone()
+    if row:
+        conn.execute('UPDATE thumbnail SET accesstime = ? WHERE key = ?', (int(time.time()), key))
+        conn.commit()
+        return bytes(row[0])
+
+
+def put(key, png):
+    conn.execute('INSERT OR REPLACE INTO thumbnail (key, png, size, accesstime) VALUES (?, ?, ?, ?)',
+                 (key, sqlite3.Binary(png), len(png), int(time.time())))
+    evict()
+    conn.commit()
+
+
+def evict():
+    """Drop the least recently used thumbnails until the store fits its budget."""
+    with closing(conn.execute('SELECT COALESCE(SUM(size), 0) FROM thumbnail')) as cursor:
+        excess = cursor.fetchone()[0] - config.THUMBNAIL_CACHE_MAX_BYTES
+    if excess <= 0:
+        return
+    victims = []
+    with closing(conn.execute('SELECT key, size FROM thumbnail ORDER BY accesstime')) as cursor:
+        for key, size in cursor:
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+    conn.executemany('DELETE FROM thumbnail WHERE key = ?', victims)
@@ -1,26 +1,224 @@
-import tempfile
-import os
+import re
+import threading
+import concurrent.futures
 import contextlib
 
 import requests
+import requests.adapters
+from . import config
 from . import fusion360utils as futil
+from .blobcache import blob_cache
+
+# GitHub tree entries point at the blob API, which embeds the blob sha.
+_blob_url_re = re.compile(r'/git/blobs/([0-9a-f]{40})$')
+_content_range_re = re.compile(r'bytes (\d+)-')
+
+
+def content_key(url, sha=None):
+    """
+    Cache key for the content behind `url`.  Keys for GitHub blobs name the
+    content itself and never go stale; anything else is keyed by URL and must
+    be revalidated.
+    """
+    if not sha:
+        match = _blob_url_re.search(url)
+        sha = match and match.group(1)
+    if sha:
+        return 'blob:{}'.format(sha)
+    return 'url:{}'.format(url)
+
+
+class DownloadError(IOError):
+    pass
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared keep-alive session, with a bounded connection pool per host."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=config.HTTP_POOL_MAXSIZE, pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def _stream_to_file(response, url, headers, f):
+    """
+    Write the body of a streamed `response` to `f` in fixed-size chunks,
+    resuming with a Range request if the connection drops part way through.
+    """
+    expected = response.headers.get('Content-Length')
+    # downloads ask for identity encoding, but a server may compress anyway;
+    # the body is then decoded while streaming, so neither its length nor a
+    # byte range of it match what's written.
+    encoded = bool(response.headers.get('Content-Encoding'))
+    expected = int(expected) if expected and not encoded else None
+    if expected is not None and expected > config.DOWNLOAD_MAX_BYTES:
+        response.close()
+        raise DownloadError('{} is too large ({} bytes)'.format(url, expected))
+
+    written = 0
+    retries = 0
+    while True:
+        try:
+            with contextlib.closing(response):
+                for chunk in response.iter_content(config.DOWNLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > config.DOWNLOAD_MAX_BYTES:
+                        raise DownloadError('{} exceeds {} bytes'.format(url, config.DOWNLOAD_MAX_BYTES))
+                    f.write(chunk)
+            break
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+            retries += 1
+            if retries > config.DOWNLOAD_RETRIES:
+                raise
+            futil.log('Download of {} interrupted at {} bytes, resuming'.format(url, written))
+
+        resume_headers = {k: v for k, v in headers.items() if not k.startswith('If-')}
+        if not encoded:
+            resume_headers['Range'] = 'bytes={}-'.format(written)
+            if response.headers.get('ETag'):
+                resume_headers['If-Range'] = response.headers['ETag']
+        response = get_session().get(url, headers=resume_headers, stream=True, timeout=config.HTTP_TIMEOUT)
+        if response.status_code == 200:
+            # server ignored the range (or the content changed), start over.
+            f.seek(0)
+            f.truncate()
+            written = 0
+        elif response.status_code != 206:
+            response.close()
+            response.raise_for_status()
+            raise DownloadError('Unexpected {} resuming {}'.format(response.status_code, url))
+        else:
+            match = _content_range_re.match(response.headers.get('Content-Range', ''))
+            if match is None or int(match.group(1)) != written:
+                response.close()
+                raise DownloadError('{} resumed at {} instead of byte {}'.format(
+                    url, response.headers.get('Content-Range'), written))
+
+    if expected is not None and written != expected:
+        raise DownloadError('{} ended after {} of {} bytes'.format(url, written, expected))
+
+
+def fetch(url, token, sha=None):
+    """
+    Make sure the content behind `url` is in the blob cache, downloading or
+    revalidating it as needed, and return its cache key.
+    """
+    key = content_key(url, sha)
+    cached = blob_cache.get(key)
+    if cached and key.startswith('blob:'):
+        return key
+
+    # identity encoding, so Content-Length and resume offsets count the bytes written.
+    headers = {'Accept': 'application/vnd.github.raw', 'Accept-Encoding': 'identity',
+               'Authorization': 'Bearer {}'.format(token)}
+    if cached:
+        meta = blob_cache.get_meta(key)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response = get_session().get(url, headers=headers, stream=True, timeout=config.HTTP_TIMEOUT)
+
+    if cached and response.status_code == 304:
+        response.close()
+        return key
+
+    if not response.ok:
+        response.close()
+        response.raise_for_status()
+
+    meta = dict(etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'))
+    with blob_cache.writer(key, meta) as f:
+        _stream_to_file(response, url, headers, f)
+    return key
+
+
+def is_cached(url, sha=None):
+    """True if `url` can be served without touching the network."""
+    key = content_key(url, sha)
+    return key.startswith('blob:') and blob_cache.get(key) is not None
+
+
+_pool = None
+_inflight = dict()
+_inflight_lock = threading.Lock()
+
+
+def get_download_pool():
+    """Bounded worker pool for background downloads."""
+    global _pool
+    with _inflight_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.DOWNLOAD_WORKERS, thread_name_prefix='ConstructDownload')
+        return _pool
+
+
+def shutdown_download_pool():
+    global _pool
+    with _inflight_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_async(url, token, sha=None):
+    """
+    Start `fetch` on the download pool and return its future.  Concurrent
+    requests for the same content share a single download.
+    """
+    key = content_key(url, sha)
+    pool = get_download_pool()
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = pool.submit(fetch, url, token, sha)
+        _inflight[key] = future
+    # outside the lock: the callback runs immediately if the future is done.
+    future.add_done_callback(lambda f: _inflight_done(key, f))
+    return future
+
+
+def _inflight_done(key, future):
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+
+def inflight(url, sha=None):
+    """The future of a background download of `url`, if one is running."""
+    with _inflight_lock:
+        return _inflight.get(content_key(url, sha))
 
 
 @contextlib.contextmanager
-def download(url, token, filename=None, extension=''):
+def download(url, token, filename=None, extension='', sha=None):
 
     if not filename:
         filename = 'model'
 
     filename = '{}.{}'.format(filename, extension)
-    response = requests.get(url, headers={'Accept': 'application/vnd.github.raw', 'Authorization': 'Bearer {}'.format(token)})
-
-    with tempfile.TemporaryDirectory() as temp_dir:
-        full_path = os.path.join(temp_dir, filename)
 
-        with open(full_path, 'wb') as temp_file:
-            temp_file.write(response.content)
+    pending = inflight(url, sha)
+    if pending is not None:
+        # a prefetch is already on it; any failure is retried below.
+        concurrent.futures.wait([pending])
 
+    key = fetch(url, token, sha)
+    with blob_cache.checkout(key, filename) as full_path:
         yield full_path
 
 